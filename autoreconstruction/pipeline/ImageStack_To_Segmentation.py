@@ -1,8 +1,9 @@
 import numpy as np
+import torch
 from autoreconstruction.pytorch_segment.neurotorch.nets.RSUNetMulti import RSUNetMulti
 from autoreconstruction.pytorch_segment.neurotorch.core.predictor_multilabel import Predictor
 from autoreconstruction.pytorch_segment.neurotorch.datasets.filetypes import TiffVolume
-from autoreconstruction.pytorch_segment.neurotorch.datasets.dataset import Array
+from autoreconstruction.pytorch_segment.neurotorch.datasets.dataset import Array, CudaArray
 from autoreconstruction.pytorch_segment.neurotorch.datasets.datatypes import BoundingBox, Vector
 import tifffile as tif
 import os
@@ -11,7 +12,21 @@ import pandas as pd
 from datetime import date
 
 
-def validate(checkpoint, specimen_dir, chunk_dir, raw_single_tif_dir,  bb, ids, error_list, gpu):
+def build_predictor(checkpoint, gpu, invert=False):
+    """
+    Builds the multilabel segmentation predictor. The predictor can be shared across chunks and specimens so the
+    checkpoint is loaded and the network is compiled only once
+
+    :param checkpoint: checkpoint file
+    :param gpu: 0
+    :param invert: boolean to invert image color on the device, for stacks that were not inverted in preprocessing
+    :return: Predictor
+    """
+    net = RSUNetMulti()
+    return Predictor(net, checkpoint, gpu_device=gpu, invert=invert)
+
+
+def validate(checkpoint, specimen_dir, chunk_dir, raw_single_tif_dir,  bb, ids, error_list, gpu, predictor=None):
     """
     Will run run segmentation on input directory of 3d tif volumes. These volumes should have dimensions:
     64*n x 64*m x 32. Segmentation will create a subdirectory in the specimen_dir named Segmentation
@@ -25,6 +40,7 @@ def validate(checkpoint, specimen_dir, chunk_dir, raw_single_tif_dir,  bb, ids,
     :param ids: specimen id
     :param error_list: empty list populated with any errors that occur
     :param gpu: 0
+    :param predictor: predictor from build_predictor, one is built from the checkpoint if None
     :return: None
     """
     files_per_chunk = 32
@@ -51,8 +67,8 @@ def validate(checkpoint, specimen_dir, chunk_dir, raw_single_tif_dir,  bb, ids,
    
     #Step 2. Run segmentation 
     if True:#try:
-        net = RSUNetMulti()
-        predictor = Predictor(net, checkpoint, gpu_device=gpu)
+        if predictor is None:
+            predictor = build_predictor(checkpoint, gpu)
 
         count = [0,0,0]
         number_of_small_segments = len([ff for ff in os.listdir(chunk_dir) if '.tif' in ff])
@@ -63,12 +79,21 @@ def validate(checkpoint, specimen_dir, chunk_dir, raw_single_tif_dir,  bb, ids,
             nth_tiff_stack = os.path.join(chunk_dir,'chunk{}.tif'.format(n))
             with TiffVolume(nth_tiff_stack, bbn) as inputs:                         
                 
+                # Pad edge tiles white when the predictor inverts, so they are black like on inverted stacks
+                if predictor.invert:
+                    inputs.getArray().setPadValue(255)
+
                 # Predict
-                predictor = Predictor(net, checkpoint, gpu_device=gpu)
                 # output_volume is a list (len3) of Arrays for each of 3 foreground channels (soma, axon, dendrite)
-                output_volume = [Array(np.zeros(inputs.getBoundingBox().getNumpyDim(), dtype=np.uint8)) for _ in range(3)] 
+                shape = inputs.getBoundingBox().getNumpyDim()
+                if predictor.device.type == "cuda":
+                    # Blend on the GPU and copy each channel back once
+                    output_volume = [CudaArray(torch.zeros(shape, dtype=torch.uint8, device=predictor.device)) for _ in range(3)]
+                else:
+                    output_volume = [Array(np.zeros(shape, dtype=np.uint8)) for _ in range(3)]
                 print('bb0', inputs.getBoundingBox())
                 predictor.run(inputs, output_volume)      
+                output_volume = [volume.toArray() if isinstance(volume, CudaArray) else volume for volume in output_volume]
                 
                 for ch in range(3):
                     ch_dir = os.path.join(seg_dir,'ch%d'%(ch+1))
@@ -117,7 +142,7 @@ def validate(checkpoint, specimen_dir, chunk_dir, raw_single_tif_dir,  bb, ids,
     return error_list
 
 
-def main(ckpt, specimen_dir, raw_single_tif_dir, specimen_id, gpu, **kwargs ):
+def main(ckpt, specimen_dir, raw_single_tif_dir, specimen_id, gpu, predictor=None, **kwargs ):
 
     today = date.today()
     todays_date = today.strftime("%b_%d_%Y")
@@ -136,8 +161,10 @@ def main(ckpt, specimen_dir, raw_single_tif_dir, specimen_id, gpu, **kwargs ):
         bb_r = df_r.bound_boxing.values
 
         #Validate
-        validate(ckpt, specimen_dir, chunk_dir_left, raw_single_tif_dir, bb_l, specimen_id, [], gpu)
-        validate(ckpt, specimen_dir, chunk_dir_right, raw_single_tif_dir, bb_r, specimen_id, [], gpu)
+        if predictor is None:
+            predictor = build_predictor(ckpt, gpu)
+        validate(ckpt, specimen_dir, chunk_dir_left, raw_single_tif_dir, bb_l, specimen_id, [], gpu, predictor)
+        validate(ckpt, specimen_dir, chunk_dir_right, raw_single_tif_dir, bb_r, specimen_id, [], gpu, predictor)
 
 
     else:
@@ -150,5 +177,5 @@ def main(ckpt, specimen_dir, raw_single_tif_dir, specimen_id, gpu, **kwargs ):
         bb = df.bound_boxing.values
 
         #validate
-        validate(ckpt, specimen_dir, chunk_dir, raw_single_tif_dir, bb, specimen_id, [], gpu)
+        validate(ckpt, specimen_dir, chunk_dir, raw_single_tif_dir, bb, specimen_id, [], gpu, predictor)
 
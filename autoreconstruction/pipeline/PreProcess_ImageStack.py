@@ -80,7 +80,7 @@ def myround64(x, base=64):
 def myround16(x,base=16):
     return base*int(x/base)
 
-def process_specimen(ids,specimen_dir,raw_single_tif_dir,invert_image_color):
+def process_specimen(ids,specimen_dir,raw_single_tif_dir,invert_image_color,invert_on_device=False):
     """
     Worker function for script that will do a number of pre-processing steps. Mostly focused on putting the input images
     into a format (dimensions and color inversion) the neural network will be compatible with. The network was trained with
@@ -102,6 +102,8 @@ def process_specimen(ids,specimen_dir,raw_single_tif_dir,invert_image_color):
     :param specimen_dir: root directory for specimen
     :param raw_single_tif_dir: input directory of single tif images
     :param invert_image_color: boolean to invert images or not
+    :param invert_on_device: boolean to leave inversion to the predictor, the images are then not rewritten inverted
+    but the max intensity projections are still made from inverted images
     :return:
     """
 
@@ -144,11 +146,12 @@ def process_specimen(ids,specimen_dir,raw_single_tif_dir,invert_image_color):
                 img = imread(os.path.join(raw_single_tif_dir,f))
                 cropped_img = img[y1:y2,x1:x2]
 
-                if invert_image_color:
+                if invert_image_color and not invert_on_device:
                     cropped_img_inverted = 255 - cropped_img
                     imwrite(os.path.join(raw_single_tif_dir,f), cropped_img_inverted)
-                else:
+                elif cropped_img.shape != img.shape:
                     imwrite(os.path.join(raw_single_tif_dir, f), cropped_img)
+                #otherwise the image is unchanged and is not rewritten (inversion can be done by the predictor)
 
     except:
         print('Unable to crop and invert images for {}'.format(ids))
@@ -299,6 +302,8 @@ def process_specimen(ids,specimen_dir,raw_single_tif_dir,invert_image_color):
             error_list.append('{} Step 9'.format(ids))
 
     #make mip for single tiff files dir and then delete those dirs
+    #images left for the predictor to invert are inverted here, so the mip matches an inversion on disk
+    invert_mip = invert_image_color and invert_on_device
     if left_and_right == True:
          raw_single_tif_dir_right = os.path.join(specimen_dir,'Single_Tif_Images_Right')
          mip_ofile_right = os.path.join(specimen_dir,'Single_Tif_Images_Right_Mip.tif')
@@ -306,19 +311,20 @@ def process_specimen(ids,specimen_dir,raw_single_tif_dir,invert_image_color):
          raw_single_tif_dir_left = os.path.join(specimen_dir,'Single_Tif_Images_Left')
          mip_ofile_left = os.path.join(specimen_dir,'Single_Tif_Images_Left_Mip.tif')
 
-         dir_to_mip(indir = raw_single_tif_dir_right, ofile = mip_ofile_right )
-         dir_to_mip(indir = raw_single_tif_dir_left, ofile = mip_ofile_left )
+         dir_to_mip(indir = raw_single_tif_dir_right, ofile = mip_ofile_right, invert = invert_mip )
+         dir_to_mip(indir = raw_single_tif_dir_left, ofile = mip_ofile_left, invert = invert_mip )
 
     else:
         mip_ofile = os.path.join(specimen_dir,"Single_Tif_Images_Mip.tif")
-        dir_to_mip(indir=raw_single_tif_dir, ofile = mip_ofile)
+        dir_to_mip(indir=raw_single_tif_dir, ofile = mip_ofile, invert = invert_mip)
 
     return error_list
 
-def dir_to_mip(indir,ofile,mip_axis=2):
+def dir_to_mip(indir,ofile,mip_axis=2,invert=False):
     """
     From a directory of single tif files, will create a maximum intensity projection (mip) along certain axis
     example: if mip_axis=2 creates xy mip
+    if invert is True, the projection is made from the color inverted images (255 - img)
     """
 
     indir_files = os.listdir(indir)
@@ -335,16 +341,19 @@ def dir_to_mip(indir,ofile,mip_axis=2):
         img = imread(pth)
         full_img[:,:,ct] = img
 
+    if invert:
+        full_img = 255 - full_img
+
     mip_z_axis = np.max(full_img, axis=mip_axis).astype(data_type)
     imwrite(ofile,mip_z_axis)
 
 
-def main(specimen_id, raw_single_tif_dir, specimen_dir, invert_image_color, **kwargs):
+def main(specimen_id, raw_single_tif_dir, specimen_dir, invert_image_color, invert_on_device=False, **kwargs):
 
     if not specimen_dir:
         specimen_dir = os.path.dirname(raw_single_tif_dir)
 
-    returned_error_list = process_specimen(specimen_id,specimen_dir, raw_single_tif_dir, invert_image_color)
+    returned_error_list = process_specimen(specimen_id,specimen_dir, raw_single_tif_dir, invert_image_color, invert_on_device)
     if returned_error_list!=[]:
         print("error occured in preprocessing:")
         print(returned_error_list)
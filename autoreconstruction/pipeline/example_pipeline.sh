@@ -8,7 +8,9 @@ invert_image_color="True"
 ckpt="aspiny_model.ckpt"
 intensity_threshold=252
 
-tar -xzvf ${raw_single_tif_dir_tarball} -C ${specimen_dir}
+if [ ! -d ${raw_single_tif_dir} ]; then
+    tar -xzf ${raw_single_tif_dir_tarball} -C ${specimen_dir}
+fi
 
 echo "RUNNING IMAGE STACK PRE PROCESSING"
 python PreProcess_ImageStack.py --specimen_dir ${specimen_dir} \
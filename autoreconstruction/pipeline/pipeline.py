@@ -10,6 +10,7 @@ import time
 
 from autoreconstruction.pipeline.PreProcess_ImageStack import main as process_specimen
 from autoreconstruction.pipeline.ImageStack_To_Segmentation import main as segment_stacks
+from autoreconstruction.pipeline.ImageStack_To_Segmentation import build_predictor
 from autoreconstruction.pipeline.Segmentation_To_Skeleton import main as postprocess
 # from autoreconstruction.pipeline.Skeleton_To_Swc import main as skeleton_to_swc
 
@@ -45,6 +46,8 @@ TO_SWC = False  # generate SWC file from skeleton
 
 # UNet expects input with black background, y and x divisible by chunk_ds
 INVERT_COLOR = True
+# invert on the segmentation device instead of rewriting every tif on disk
+INVERT_ON_DEVICE = True
 
 
 CHECKPOINT_CKPT = (
@@ -65,7 +68,7 @@ SPECIMENS = [
 ]
 
 
-def __main__(specimen):
+def __main__(specimen, predictor=None):
     specimen_dir = BASE_DIR + D + specimen
     raw_dir = specimen_dir + D + "Example_Input_Stack"
     if PREPROCESS:  # running image stack processing
@@ -74,7 +77,8 @@ def __main__(specimen):
             specimen_id=specimen,
             raw_single_tif_dir=raw_dir,
             specimen_dir=specimen_dir,
-            invert_image_color=INVERT_COLOR)
+            invert_image_color=INVERT_COLOR,
+            invert_on_device=INVERT_ON_DEVICE)
         print(f"preprocess time: {sec_to_time(time.time() - sub_time)}")
     if SEGMENT:  # running image stack segmentation
         sub_time = time.time()
@@ -83,7 +87,8 @@ def __main__(specimen):
             specimen_dir=specimen_dir,
             raw_single_tif_dir=raw_dir,
             specimen_id=specimen,
-            gpu=0)
+            gpu=0,
+            predictor=predictor)
         print(f"segment time: {sec_to_time(time.time() - sub_time)}")
     if SKELETONIZE:  # running segmentation to skeleton
         sub_time = time.time()
@@ -106,9 +111,13 @@ def __main__(specimen):
 
 if __name__ == "__main__":
     global_start = time.time()
+    # load the network once and keep it resident across specimens
+    predictor = build_predictor(
+        CHECKPOINT_CKPT, 0,
+        invert=INVERT_COLOR and INVERT_ON_DEVICE) if SEGMENT else None
     for s in SPECIMENS:
         print(f"\nautoreconning {s}", "\n", "-" * 60)
         t0 = time.time()
-        __main__(s)
+        __main__(s, predictor)
 
     print(f"Autorecon completed in: {sec_to_time(time.time() - global_start)}")
@@ -0,0 +1,778 @@
+import torch
+from torch.utils.data import DataLoader
+import numpy as np
+import io
+import copy
+import os
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from autoreconstruction.pytorch_segment.neurotorch.datasets.dataset import Data
+
+try:
+    import tensorrt as trt
+except ImportError:
+    # TensorRT is optional, the predictors fall back to PyTorch without it
+    trt = None
+
+
+def load_state_dict(checkpoint):
+    """
+    Loads a checkpoint state dict by memory-mapping its tensors on the host.
+Results are cached so predictors built for successive specimens skip the
+reload, until the checkpoint file is rewritten
+
+    :param checkpoint: The checkpoint filename
+    :return: The state dict of the checkpoint
+    """
+    stat = os.stat(checkpoint)
+    return _load_state_dict(checkpoint, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=4)
+def _load_state_dict(checkpoint, mtime_ns, size):
+    # The tensors stay on the CPU, so cached state dicts only hold mapped
+    # pages and no device memory
+    return torch.load(checkpoint, map_location="cpu", mmap=True,
+                      weights_only=True)
+
+
+# Integer images are uploaded in their own dtype and converted to float32 on
+# the device. torch only has unsigned 16-bit tensors from version 2.3
+HOST_DTYPES = {np.dtype(np.uint8): torch.uint8,
+               np.dtype(np.int16): torch.int16}
+if hasattr(torch, "uint16"):
+    HOST_DTYPES[np.dtype(np.uint16)] = torch.uint16
+
+
+def host_dtype(dtype):
+    """
+    Picks the dtype batches are stacked and uploaded in. 8-bit and 16-bit
+images are uploaded as they are and converted to float32 on the device, which
+moves a quarter or half of the bytes across the bus
+
+    :param dtype: The NumPy dtype of the input samples
+    """
+    return HOST_DTYPES.get(np.dtype(dtype), torch.float32)
+
+
+def cat_outputs(outputs):
+    """
+    Concatenates the outputs of the net's output layers. The net returns a
+list even with a single output layer, which torch.cat would only copy
+    """
+    return outputs[0] if len(outputs) == 1 else torch.cat(outputs)
+
+
+def collate_data(batch, out=None):
+    """
+    Stacks a batch of data packets into a single float32 array. This is a
+module-level function so DataLoader workers can pickle it
+
+    :param batch: A list of data packets with equal array shapes
+    :param out: A (B, 1, Z, Y, X) CPU tensor to fill. A new tensor is
+allocated if None
+    :return: The bounding boxes of the packets and a (B, 1, Z, Y, X) tensor
+    """
+    bounding_boxes = [data.getBoundingBox() for data in batch]
+
+    if out is None:
+        array = batch[0].getArray()
+        out = torch.empty((len(batch), 1, *array.shape),
+                          dtype=host_dtype(array.dtype))
+
+    # Fill a single buffer instead of concatenating per-sample arrays, any
+    # cast happens during the assignment
+    arrays = out.numpy()
+    for i, data in enumerate(batch):
+        arrays[i, 0] = data.getArray()
+
+    return bounding_boxes, out
+
+
+def prefetch(batches):
+    """
+    Gathers the next batch on a background thread while the current one is
+processed. Tiles are gathered with the GIL released, so this overlaps host
+reads with the forward pass without the DataLoader worker processes that
+copy the whole input volume
+
+    :param batches: An iterable of batches
+    """
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        batches = iter(batches)
+        pending = pool.submit(next, batches, None)
+        while True:
+            batch = pending.result()
+            if batch is None:
+                return
+
+            pending = pool.submit(next, batches, None)
+            yield batch
+
+
+class BasePredictor:
+    """
+    Runs a net over an input volume on the CPU or a CUDA device. Predictors
+subclass it to turn the net's outputs into the arrays blended into their
+output volumes
+    """
+    # The number of tiles per forward pass on the CPU
+    cpu_batch_size = 20
+
+    def __init__(self, net, checkpoint, gpu_device=None, invert=False,
+                 compile_net=True, use_tensorrt=False, engine_file=None):
+        self.setNet(net, gpu_device=gpu_device, compile_net=compile_net,
+                    use_tensorrt=use_tensorrt, engine_file=engine_file)
+        self.loadCheckpoint(checkpoint)
+        self.setInvert(invert)
+
+        # Finished batches are blended on a background thread while the
+        # device runs the next ones
+        self.blend_thread = ThreadPoolExecutor(max_workers=1)
+
+    def setNet(self, net, gpu_device=None, compile_net=True,
+               use_tensorrt=False, engine_file=None):
+        self.device = torch.device("cuda:{}".format(gpu_device)
+                                   if gpu_device is not None
+                                   else "cpu")
+
+        self.net = net.to(self.device).eval()
+        self.memory_format = torch.contiguous_format
+        self.tuned_batch_sizes = {}
+        self.pinned_buffers = None
+        self.pinned_index = 0
+        self.pinned_events = {}
+        self.staging_buffers = None
+        self.staging_index = 0
+
+        if self.device.type == "cuda":
+            # Input shapes are fixed, so cuDNN only has to search for the
+            # fastest convolution algorithms once
+            torch.backends.cudnn.benchmark = True
+            torch.backends.cudnn.allow_tf32 = True
+            torch.backends.cuda.matmul.allow_tf32 = True
+
+            self.memory_format = torch.channels_last_3d
+            self.net = self.net.to(memory_format=self.memory_format)
+
+        self.inference_net = self.net
+        self.setCompiledNet(compile_net)
+        self.setEngine(use_tensorrt, engine_file)
+
+    def setCompiledNet(self, compile_net=True):
+        """
+        Wraps the inference net for repeated fixed-shape inference. It is
+wrapped again whenever a checkpoint is loaded
+
+        :param compile_net: False to keep the eager net, e.g. to compare
+predictions against the compiled net
+        """
+        self.compile_net = compile_net
+        self.compiled_net = self.inference_net
+        self.graph = None
+
+        if self.device.type == "cuda" and compile_net:
+            self.compiled_net = torch.compile(self.inference_net)
+
+    def setEngine(self, use_tensorrt, engine_file=None):
+        """
+        Sets whether the forward pass runs through a TensorRT engine with FP16
+tactics, built from an ONNX export of the net on the first batch. The PyTorch
+path is kept on the CPU or when TensorRT is not installed
+
+        :param use_tensorrt: True to run the net through TensorRT
+        :param engine_file: A file the serialized engine is saved to and
+loaded from in later runs, so it is only built once per batch and tile shape.
+It must be deleted when the checkpoint changes
+        """
+        self.use_tensorrt = (use_tensorrt and trt is not None
+                             and self.device.type == "cuda")
+        self.engine = None
+        self.engine_file = engine_file
+
+    def setInvert(self, invert):
+        """
+        Sets whether input intensities are inverted (255 - x) on the device,
+which replaces inverting the image stack on disk during preprocessing. The
+input volume should then be padded with 255, see Array.setPadValue
+
+        :param invert: True to invert the inputs
+        """
+        self.invert = invert
+
+    def getNet(self):
+        return self.net
+
+    def loadCheckpoint(self, checkpoint):
+        self.getNet().load_state_dict(load_state_dict(checkpoint))
+        self.setInferenceNet()
+
+    def setInferenceNet(self):
+        """
+        Builds the net the forward pass runs from the loaded weights. Batch
+norms use fixed statistics at inference, so they are folded into the convs of
+a copy of the net. getNet() keeps the unfused net, so its state dict matches
+the training checkpoints and later checkpoints still load into it
+        """
+        self.inference_net = self.getNet()
+        if hasattr(self.getNet(), "fuse_for_inference"):
+            self.inference_net = copy.deepcopy(self.getNet())
+            self.inference_net.fuse_for_inference()
+
+        # The compiled net, CUDA graph and engine were built from the
+        # previous weights
+        self.setCompiledNet(self.compile_net)
+        self.engine = None
+
+    def run(self, input_volume, output_volume, batch_size=None,
+            num_workers=0):
+        """
+        Segments the input volume into the output volume
+
+        :param input_volume: The volume to segment
+        :param output_volume: The volume the predictions are blended into
+        :param batch_size: The number of tiles per forward pass. By default,
+the largest batch that fits in GPU memory is used on CUDA devices, which
+trades latency for throughput, and cpu_batch_size tiles are used on the CPU.
+On CUDA devices the volume is run again with half the batch size if a batch
+runs out of memory
+        :param num_workers: The number of DataLoader worker processes
+        """
+        with torch.inference_mode():
+            if batch_size is None and self.device.type == "cuda":
+                batch_size = self.autotuneBatchSize(input_volume)
+            elif batch_size is None:
+                batch_size = self.cpu_batch_size
+            self.setBatchSize(batch_size)
+
+            while True:
+                try:
+                    return self.runBatches(input_volume, output_volume,
+                                           num_workers)
+                except torch.cuda.OutOfMemoryError:
+                    if self.device.type != "cuda" or self.getBatchSize() == 1:
+                        raise
+
+                # Blending takes the maximum, so tiles blended before the
+                # error are unchanged when they are blended again
+                self.setBatchSize(self.getBatchSize() // 2)
+                self.tuned_batch_sizes[input_volume[0].getArray().shape] = \
+                    self.getBatchSize()
+                self.releaseGraph()
+                torch.cuda.empty_cache()
+
+    def runBatches(self, input_volume, output_volume, num_workers=0):
+        """
+        Segments the input volume into the output volume in batches of the
+batch size
+        """
+        if num_workers > 0:
+            # Worker processes read and stack the next batches while the
+            # current one is on the device
+            batches = DataLoader(input_volume,
+                                 batch_size=self.getBatchSize(),
+                                 num_workers=num_workers,
+                                 collate_fn=collate_data,
+                                 pin_memory=self.device.type == "cuda",
+                                 prefetch_factor=2)
+        else:
+            length = len(input_volume)
+            batch_size = self.getBatchSize()
+            batches = (self.gatherBatch(input_volume,
+                                        range(start, min(start+batch_size, length)))
+                       for start in range(0, length, batch_size))
+            batches = prefetch(batches)
+
+        try:
+            if self.device.type == "cuda":
+                self.run_streamed(batches, output_volume)
+            else:
+                for bounding_boxes, arrays in batches:
+                    outputs = self.forward(self.toDevice(arrays))
+                    self.blendOutputs(outputs, bounding_boxes, output_volume)
+        finally:
+            # Stop the prefetch thread before its buffers are reused
+            if num_workers == 0:
+                batches.close()
+
+    def run_streamed(self, batches, output_volume):
+        """
+        Runs the batches while overlapping the host-to-device copy of the
+next batch with the forward pass of the current one. Outputs are copied back
+asynchronously and blended on a background thread, so the device moves on to
+the next batch without waiting for the host
+        """
+        copy_stream = torch.cuda.Stream(device=self.device)
+        compute_stream = torch.cuda.current_stream(self.device)
+
+        def upload(batch):
+            bounding_boxes, arrays = batch
+            with torch.cuda.stream(copy_stream):
+                return bounding_boxes, self.toDevice(arrays)
+
+        def blend(arrays, copied, bounding_boxes):
+            copied.synchronize()
+            self.blendArrays(arrays, bounding_boxes, output_volume)
+
+        on_device = self.isOnDevice(output_volume)
+        blends = deque()
+        batches = iter(batches)
+        batch = next(batches, None)
+        pending = upload(batch) if batch is not None else None
+        try:
+            while pending is not None:
+                compute_stream.wait_stream(copy_stream)
+                bounding_boxes, inputs = pending
+                inputs.record_stream(compute_stream)
+
+                outputs = self.forward(inputs)
+                batch = next(batches, None)
+                pending = upload(batch) if batch is not None else None
+
+                if on_device:
+                    tensor = self.quantizeOutputs(outputs)
+                    self.blendArrays(tensor, bounding_boxes, output_volume)
+                    continue
+
+                # The staging buffer about to be reused must have been blended
+                while len(blends) > 1:
+                    blends.popleft().result()
+
+                arrays, copied = self.toHostAsync(self.quantizeOutputs(outputs))
+                blends.append(self.blend_thread.submit(blend, arrays, copied,
+                                                       bounding_boxes))
+        finally:
+            # Blends still read the staging buffers if a batch failed
+            for pending_blend in blends:
+                pending_blend.result()
+
+    def autotuneBatchSize(self, input_volume):
+        """
+        Finds the largest batch of tiles that fits in GPU memory by doubling
+the batch size until a batch runs out of memory, then backing off by 20%.
+Batches are probed through forward(), so the memory of the compiled net, the
+CUDA graph or the TensorRT engine is counted. An engine is built for every
+probed batch size, so pass a batch size to run() to skip tuning with TensorRT
+        """
+        array = input_volume[0].getArray()
+        shape = array.shape
+        if shape in self.tuned_batch_sizes:
+            return self.tuned_batch_sizes[shape]
+
+        batch_size, last_success = 1, 0
+        while True:
+            self.setBatchSize(batch_size)
+            out_of_memory = False
+            try:
+                self.probeBatch(shape, host_dtype(array.dtype))
+            except torch.cuda.OutOfMemoryError:
+                out_of_memory = True
+
+            # Graphs are captured for a single batch size
+            self.releaseGraph()
+            torch.cuda.empty_cache()
+
+            if out_of_memory:
+                batch_size = max(1, int(0.8 * last_success))
+                break
+
+            last_success = batch_size
+            if batch_size >= len(input_volume):
+                break
+            batch_size = min(2 * batch_size, len(input_volume))
+
+        self.tuned_batch_sizes[shape] = batch_size
+
+        return batch_size
+
+    def probeBatch(self, shape, dtype):
+        """
+        Runs a full batch of blank tiles through forward() while holding the
+other device memory of a streamed run: the next batch being uploaded and the
+quantized outputs that are still being copied back
+
+        :param shape: The (Z, Y, X) shape of a tile
+        :param dtype: The dtype batches are uploaded in
+        """
+        inputs, next_inputs = [torch.zeros((self.getBatchSize(), 1, *shape),
+                                           dtype=dtype, device=self.device)
+                               for _ in range(2)]
+        outputs = [self.quantizeOutputs(self.forward(inputs))
+                   for _ in range(2)]
+        torch.cuda.synchronize(self.device)
+
+    def releaseGraph(self):
+        """
+        Frees the captured CUDA graph, its memory pool and static tensors
+        """
+        self.graph = None
+        self.static_inputs = None
+        self.static_outputs = None
+
+    def getBatchSize(self):
+        return self.batch_size
+
+    def setBatchSize(self, batch_size):
+        self.batch_size = batch_size
+
+    def run_batch(self, batch, output_volume):
+        bounding_boxes, inputs = self.toTorch(batch)
+
+        outputs = self.forward(inputs)
+        self.blendOutputs(outputs, bounding_boxes, output_volume)
+
+    def forward(self, inputs):
+        """
+        Runs the net on a batch of inputs as uploaded by toDevice. On the
+CUDA graph path they are converted and inverted while being copied into the
+captured input, otherwise by toFloat
+        """
+        if self.use_tensorrt:
+            return self.runEngine(self.toFloat(inputs))
+
+        # Half precision is only worthwhile on tensor-core GPUs, the CPU path
+        # keeps running in float32. The autocast weight cache must be off
+        # for CUDA graph capture
+        with torch.autocast(device_type=self.device.type,
+                            enabled=self.device.type == "cuda",
+                            cache_enabled=False):
+            if self.device.type == "cuda":
+                return self.replayGraph(inputs)
+
+            return self.compiled_net(self.toFloat(inputs))
+
+    def runEngine(self, inputs):
+        """
+        Runs the forward pass through the TensorRT engine, which accepts any
+batch up to the batch size. Outputs are returned in half precision
+        """
+        shape = (self.getBatchSize(), *inputs.shape[1:])
+        if self.engine is None or self.engine_shape != shape:
+            self.buildEngine(shape)
+
+        # The engine reads NCDHW inputs, not channels_last_3d
+        inputs = inputs.contiguous()
+        self.engine_context.set_input_shape("x", tuple(inputs.shape))
+        self.engine_context.set_tensor_address("x", inputs.data_ptr())
+
+        outputs = []
+        for name in self.engine_outputs:
+            output = torch.empty(tuple(self.engine_context.get_tensor_shape(name)),
+                                 dtype=torch.float16, device=self.device)
+            self.engine_context.set_tensor_address(name, output.data_ptr())
+            outputs.append(output)
+
+        stream = torch.cuda.current_stream(self.device)
+        if not self.engine_context.execute_async_v3(stream.cuda_stream):
+            raise RuntimeError("TensorRT engine failed to run")
+
+        return outputs
+
+    def buildEngine(self, shape):
+        """
+        Loads the TensorRT engine from the engine file, or builds it if there
+is no engine for this shape yet
+
+        :param shape: The (B, 1, Z, Y, X) shape of the largest batch
+        """
+        logger = trt.Logger(trt.Logger.WARNING)
+        runtime = trt.Runtime(logger)
+
+        engine = None
+        if self.engine_file is not None and os.path.isfile(self.engine_file):
+            with open(self.engine_file, "rb") as f:
+                engine = runtime.deserialize_cuda_engine(f.read())
+
+            # An engine built for another batch or tile size is rebuilt
+            if (engine is not None and
+                    tuple(engine.get_tensor_profile_shape("x", 0)[2]) != tuple(shape)):
+                engine = None
+
+        if engine is None:
+            serialized_engine = self.serializeEngine(shape, logger)
+            if self.engine_file is not None:
+                with open(self.engine_file, "wb") as f:
+                    f.write(serialized_engine)
+            engine = runtime.deserialize_cuda_engine(serialized_engine)
+
+        self.engine = engine
+        self.engine_context = self.engine.create_execution_context()
+        self.engine_shape = shape
+        self.engine_outputs = [name for name in map(engine.get_tensor_name,
+                                                    range(engine.num_io_tensors))
+                               if engine.get_tensor_mode(name) == trt.TensorIOMode.OUTPUT]
+
+    def serializeEngine(self, shape, logger):
+        """
+        Exports the net to ONNX and builds a serialized TensorRT engine for it
+
+        :param shape: The (B, 1, Z, Y, X) shape of the largest batch
+        :param logger: The TensorRT logger
+        :return: The serialized engine
+        """
+        onnx_file = io.BytesIO()
+        with torch.inference_mode(False), torch.no_grad():
+            # The batch axis is dynamic, so a single tile is enough to trace
+            example = torch.zeros((1, *shape[1:]), device=self.device)
+            output_names = ["y{}".format(i)
+                            for i in range(len(self.inference_net(example)))]
+            torch.onnx.export(self.inference_net, (example,), onnx_file,
+                              opset_version=17, input_names=["x"],
+                              output_names=output_names, dynamo=False,
+                              dynamic_axes={name: {0: "batch"}
+                                            for name in ["x", *output_names]})
+
+        builder = trt.Builder(logger)
+        network = builder.create_network(
+            1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+        parser = trt.OnnxParser(network, logger)
+        if not parser.parse(onnx_file.getvalue()):
+            raise RuntimeError("TensorRT could not parse the net: " +
+                               "{}".format(parser.get_error(0)))
+
+        for i in range(network.num_outputs):
+            network.get_output(i).dtype = trt.float16
+
+        config = builder.create_builder_config()
+        config.set_flag(trt.BuilderFlag.FP16)
+        profile = builder.create_optimization_profile()
+        profile.set_shape("x", (1, *shape[1:]), shape, shape)
+        config.add_optimization_profile(profile)
+
+        serialized_engine = builder.build_serialized_network(network, config)
+        if serialized_engine is None:
+            raise RuntimeError("TensorRT engine could not be built")
+
+        return serialized_engine
+
+    def replayGraph(self, inputs):
+        """
+        Runs the forward pass by replaying a CUDA graph of the net. Batches
+smaller than the batch size are padded into the captured input, except for
+ragged batches of at most half the batch size, which run eagerly rather than
+paying for the padding
+        """
+        size = inputs.shape[0]
+        if 2*size <= self.getBatchSize():
+            return self.inference_net(self.toFloat(inputs))
+
+        shape = (self.getBatchSize(), *inputs.shape[1:])
+        if self.graph is None or self.static_inputs.shape != shape:
+            self.captureGraph(shape)
+
+        static_inputs = self.static_inputs[:size]
+        static_inputs.copy_(inputs)
+        if self.invert:
+            static_inputs.neg_().add_(255.0)
+        self.graph.replay()
+
+        return [output[:size] for output in self.static_outputs]
+
+    def captureGraph(self, shape):
+        self.static_inputs = torch.zeros(shape, device=self.device)
+        self.static_inputs = self.static_inputs.contiguous(
+            memory_format=self.memory_format)
+
+        # Warm up on a side stream so cuDNN benchmarking and compilation
+        # are not recorded into the graph
+        stream = torch.cuda.Stream(device=self.device)
+        stream.wait_stream(torch.cuda.current_stream(self.device))
+        with torch.cuda.stream(stream):
+            if self.compiled_net is not self.inference_net:
+                try:
+                    self.compiled_net(self.static_inputs)
+                except Exception:
+                    # torch.compile needs a working Triton toolchain, so the
+                    # eager net is captured without one
+                    self.compiled_net = self.inference_net
+
+            for _ in range(3):
+                self.compiled_net(self.static_inputs)
+        torch.cuda.current_stream(self.device).wait_stream(stream)
+
+        self.graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self.graph):
+            self.static_outputs = self.compiled_net(self.static_inputs)
+
+    def blendOutputs(self, outputs, bounding_boxes, output_volume):
+        arrays = self.quantizeOutputs(outputs)
+        if not self.isOnDevice(output_volume):
+            arrays = self.toHost(arrays)
+
+        self.blendArrays(arrays, bounding_boxes, output_volume)
+
+    def isOnDevice(self, output_volume):
+        """
+        Checks whether the output volume is held on the predictor's device,
+in which case outputs are blended there without being copied back. Device
+volumes are recognized by their tensor rather than by class, since scripts
+import CudaArray through the neurotorch package as well as through
+autoreconstruction.pytorch_segment, which gives two distinct classes
+        """
+        volumes = (output_volume if isinstance(output_volume, list)
+                   else [output_volume])
+
+        return all(hasattr(volume, "toArray")
+                   and isinstance(volume.getArray(), torch.Tensor)
+                   and volume.getArray().device == self.device
+                   for volume in volumes)
+
+    def quantizeOutputs(self, outputs):
+        """
+        Converts the net's outputs to a (B, C, Z, Y, X) uint8 tensor on the
+device, so only one byte per voxel is copied back to the host before blend
+        """
+        raise NotImplementedError
+
+    def blendArrays(self, arrays, bounding_boxes, output_volume):
+        """
+        Blends a quantized batch, either a host array or a device tensor,
+into the output volume
+        """
+        raise NotImplementedError
+
+    def toHost(self, tensor):
+        """
+        Copies a quantized output batch back to the host. On CUDA devices the
+copy lands in a reusable pinned staging buffer rather than a new array every
+batch, so the returned array is only valid until the buffer is reused two
+calls later
+        """
+        if self.device.type != "cuda":
+            return tensor.cpu().numpy()
+
+        staging = self.stagingBuffer(tensor)
+        staging.copy_(tensor)
+
+        return staging.numpy()
+
+    def toHostAsync(self, tensor):
+        """
+        Starts copying a quantized output batch into a pinned staging buffer
+without blocking the host
+
+        :param tensor: A CUDA tensor
+        :return: The host array and an event that completes with the copy
+        """
+        staging = self.stagingBuffer(tensor)
+        staging.copy_(tensor, non_blocking=True)
+
+        copied = torch.cuda.Event()
+        copied.record(torch.cuda.current_stream(self.device))
+
+        return staging.numpy(), copied
+
+    def stagingBuffer(self, tensor):
+        """
+        Returns one of two alternating pinned buffers shaped like the tensor
+        """
+        if (self.staging_buffers is None
+                or self.staging_buffers[0].shape[1:] != tensor.shape[1:]
+                or self.staging_buffers[0].shape[0] < tensor.shape[0]):
+            self.staging_buffers = [torch.empty(tensor.shape,
+                                                dtype=tensor.dtype,
+                                                pin_memory=True)
+                                    for _ in range(2)]
+
+        buffer = self.staging_buffers[self.staging_index]
+        self.staging_index = 1 - self.staging_index
+
+        return buffer[:tensor.shape[0]]
+
+    def toTorch(self, batch):
+        bounding_boxes, arrays = self.stackBatch(batch)
+
+        return bounding_boxes, self.toDevice(arrays)
+
+    def stackBatch(self, batch):
+        """
+        Stacks a batch of data packets into a host buffer
+        """
+        array = batch[0].getArray()
+        arrays = self.hostBuffer(len(batch), array.shape,
+                                 host_dtype(array.dtype))
+
+        return collate_data(batch, out=arrays)
+
+    def gatherBatch(self, input_volume, indexes):
+        """
+        Gathers the samples at the given indexes into a host buffer. Volumes
+backed by an Array copy every tile in a single call instead of one data
+packet at a time
+        """
+        if not hasattr(input_volume, "getBatch"):
+            return self.stackBatch([input_volume[i] for i in indexes])
+
+        shape = input_volume.getIterationSize().getNumpyDim()
+        dtype = host_dtype(input_volume[indexes[0]].getArray().dtype)
+        arrays = self.hostBuffer(len(indexes), shape, dtype)
+        bounding_boxes = input_volume.getBatch(indexes, arrays.numpy())
+
+        return bounding_boxes, arrays
+
+    def hostBuffer(self, length, shape, dtype=torch.float32):
+        """
+        Returns a (length, 1, Z, Y, X) host buffer. On CUDA devices it is a
+reusable pinned buffer, so it can be copied asynchronously without pinning a
+new array every batch. Two buffers alternate, so the next batch is filled
+while the previous one may still be copying, and a buffer is only handed out
+again once its last copy to the device is done
+        """
+        shape = tuple(shape)
+        if self.device.type != "cuda":
+            return torch.empty((length, 1, *shape), dtype=dtype)
+
+        if (self.pinned_buffers is None
+                or self.pinned_buffers[0].shape[2:] != shape
+                or self.pinned_buffers[0].shape[0] < length
+                or self.pinned_buffers[0].dtype != dtype):
+            self.pinned_buffers = [torch.empty((length, 1, *shape),
+                                               dtype=dtype,
+                                               pin_memory=True)
+                                   for _ in range(2)]
+            self.pinned_events = {buffer.data_ptr(): None
+                                  for buffer in self.pinned_buffers}
+
+        buffer = self.pinned_buffers[self.pinned_index]
+        self.pinned_index = 1 - self.pinned_index
+
+        copied = self.pinned_events[buffer.data_ptr()]
+        if copied is not None:
+            copied.synchronize()
+
+        return buffer[:length]
+
+    def toDevice(self, arrays):
+        """
+        Copies a batch to the device in the dtype it was staged in
+        """
+        if self.device.type == "cuda" and not arrays.is_pinned():
+            arrays = arrays.pin_memory()
+
+        host_arrays = arrays
+        arrays = arrays.to(self.device, non_blocking=True)
+        if host_arrays.data_ptr() in self.pinned_events:
+            copied = torch.cuda.Event()
+            copied.record(torch.cuda.current_stream(self.device))
+            self.pinned_events[host_arrays.data_ptr()] = copied
+
+        return arrays
+
+    def toFloat(self, inputs):
+        """
+        Converts uploaded inputs to float32 in the net's memory format and
+inverts them if needed
+        """
+        inputs = inputs.to(torch.float32, memory_format=self.memory_format)
+        if self.invert:
+            inputs = inputs.neg_().add_(255.0)
+
+        return inputs
+
+    def toData(self, tensor_list, bounding_boxes):
+        tensor = self.toHost(self.quantizeOutputs(tensor_list))
+        batch = [Data(tensor[i][0], bounding_box)
+                 for i, bounding_box in enumerate(bounding_boxes)]
+
+        return batch
@@ -1,80 +1,49 @@
 import torch
-from torch.autograd import Variable
-import numpy as np
-from scipy.special import softmax
+from concurrent.futures import ThreadPoolExecutor
+from autoreconstruction.pytorch_segment.neurotorch.core.predictor_base import (
+    BasePredictor, cat_outputs)
 from autoreconstruction.pytorch_segment.neurotorch.datasets.dataset import Data
 
 
-class Predictor:
+class Predictor(BasePredictor):
     """
-    A predictor segments an input volume into an output volume
+    A predictor segments an input volume into soma, axon and dendrite output
+volumes
     """
-    def __init__(self, net, checkpoint, gpu_device=None):
-        gpu_device = gpu_device if torch.cuda.is_available() else None
-        self.setNet(net, gpu_device=gpu_device)
-        self.loadCheckpoint(checkpoint)
-
-    def setNet(self, net, gpu_device=None):
-        self.device = torch.device("cuda:{}".format(gpu_device)
-                                   if gpu_device is not None
-                                   else "cpu")
-
-        self.net = net.to(self.device).eval()
-
-    def getNet(self):
-        return self.net
-
-    def loadCheckpoint(self, checkpoint):
-        self.getNet().load_state_dict(torch.load(checkpoint, map_location=self.device))
-
-    def run(self, input_volume, output_volume, batch_size=100):
-        self.setBatchSize(batch_size)
+    cpu_batch_size = 100
 
-        with torch.no_grad():
-            batch_list = [list(range(len(input_volume)))[i:i+self.getBatchSize()]
-                          for i in range(0,
-                                         len(input_volume),
-                                         self.getBatchSize())]
-
-            for batch_index in batch_list:
-                batch = [input_volume[i] for i in batch_index]
-
-                self.run_batch(batch, output_volume)
-
-    def getBatchSize(self):
-        return self.batch_size
-
-    def setBatchSize(self, batch_size):
-        self.batch_size = batch_size
+    def __init__(self, net, checkpoint, gpu_device=None, invert=False,
+                 compile_net=True, use_tensorrt=False, engine_file=None):
+        gpu_device = gpu_device if torch.cuda.is_available() else None
+        BasePredictor.__init__(self, net, checkpoint, gpu_device=gpu_device,
+                               invert=invert, compile_net=compile_net,
+                               use_tensorrt=use_tensorrt,
+                               engine_file=engine_file)
 
-    def run_batch(self, batch, output_volume):
-        bounding_boxes, arrays = self.toTorch(batch)
-        inputs = Variable(arrays).float()
+        # Each foreground channel blends into its own volume
+        self.blend_pool = ThreadPoolExecutor(max_workers=3)
 
-        outputs = self.getNet()(inputs)
-        
-        tensor = torch.cat(outputs).data.cpu().numpy()
-        tensor = np.uint8(np.round(255*softmax(tensor, axis=1)))  # Apply softmax and convert to uint8 before blend
-        for ch in range(3):
-            data_list = [Data(tensor[i][ch+1], bounding_box) for i, bounding_box in enumerate(bounding_boxes)]
-            for data in data_list:
-                output_volume[ch].blend(data)
+    def quantizeOutputs(self, outputs):
+        # Apply softmax and convert to uint8 on the device so only one byte
+        # per voxel is copied back to the host before blend. The softmax
+        # upcasts half precision outputs itself, without a float32 copy, and
+        # the background channel is dropped before the copy
+        tensor = torch.softmax(cat_outputs(outputs), dim=1, dtype=torch.float32)
 
-    def toArray(self, data):
-        torch_data = data.getArray().astype(float)
-        torch_data = torch_data.reshape(1, 1, *torch_data.shape)
-        return torch_data
+        return tensor[:, 1:].mul_(255).round_().to(torch.uint8)
 
-    def toTorch(self, batch):
-        bounding_boxes = [data.getBoundingBox() for data in batch]
-        arrays = [self.toArray(data) for data in batch]
-        arrays = torch.from_numpy(np.concatenate(arrays, axis=0))
-        arrays = arrays.to(self.device)
+    def blendArrays(self, arrays, bounding_boxes, output_volume):
+        def blend_channel(ch):
+            output_volume[ch].blendBatch(arrays[:, ch], bounding_boxes)
 
-        return bounding_boxes, arrays
+        if isinstance(arrays, torch.Tensor):
+            # Device blends are only queued, so threads would not help
+            list(map(blend_channel, range(3)))
+        else:
+            list(self.blend_pool.map(blend_channel, range(3)))
 
     def toData(self, tensor_list, bounding_boxes):
-        tensor = torch.cat(tensor_list).data.cpu().numpy()
+        tensor = torch.cat(tensor_list).float().cpu().numpy()
         batch = [Data(tensor[i][0], bounding_box)
                  for i, bounding_box in enumerate(bounding_boxes)]
 
@@ -1,7 +1,6 @@
 import torch
 import torch.optim as optim
 import torch.nn as nn
-from torch.autograd import Variable
 import torch.cuda
 import numpy as np
 import os
@@ -13,7 +12,8 @@ class Trainer(object):
     """
     def __init__(self, net, inputs_volume, labels_volume, checkpoint_dir, checkpoint_period=5000, 
                  logger_dir=None, checkpoint=None, optimizer=None, criterion=None, 
-                 max_epochs=10, gpu_device=None, validation_split=0.2):
+                 max_epochs=10, gpu_device=None, validation_split=0.2,
+                 compile_net=True):
         """
         Sets up the parameters for training
 
@@ -22,6 +22,8 @@ class Trainer(object):
         :param labels_volume: A list containing training and validation corresponding multilabels
         :param checkpoint_dir: The directory to save checkpoints
         :param checkpoint_period: The number of iterations between checkpoints
+        :param compile_net: False to train the eager net on CUDA instead of the
+compiled one
         """
         self.max_epochs = max_epochs
 
@@ -30,6 +32,38 @@ class Trainer(object):
                                    else "cpu")
 
         self.net = net.to(self.device)
+        self.memory_format = torch.contiguous_format
+        self.amp_dtype = None
+        self.scaler = None
+
+        if self.device.type == "cuda":
+            # cuDNN's fastest 3D convolution kernels work on channels last
+            # tensors, so weights and inputs are kept in that layout
+            self.memory_format = torch.channels_last_3d
+            self.net = self.net.to(memory_format=self.memory_format)
+
+            torch.backends.cudnn.allow_tf32 = True
+            torch.backends.cuda.matmul.allow_tf32 = True
+
+            # Convolutions run in half precision under autocast. bfloat16
+            # keeps the float32 exponent range, so only float16 needs its
+            # gradients scaled to avoid underflow
+            if torch.cuda.is_bf16_supported():
+                self.amp_dtype = torch.bfloat16
+            else:
+                self.amp_dtype = torch.float16
+                # torch.amp.GradScaler replaced the CUDA one in torch 2.3
+                if hasattr(torch.amp, "GradScaler"):
+                    self.scaler = torch.amp.GradScaler(self.device.type)
+                else:
+                    self.scaler = torch.cuda.amp.GradScaler()
+
+        # The compiled net shares its parameters with the eager net, which is
+        # still the one checkpoints are saved from and loaded into, so their
+        # keys are unchanged
+        self.compiled_net = self.net
+        if self.device.type == "cuda" and compile_net:
+            self.compiled_net = torch.compile(self.net)
 
         if checkpoint is not None:
             self.net.load_state_dict(torch.load(checkpoint, map_location=lambda storage, loc: storage.cuda(0))) # fix it
@@ -72,10 +106,28 @@ class Trainer(object):
         console_handler = logging.StreamHandler()
         self.logger.addHandler(console_handler) 
                 
+    def autocast(self):
+        """
+        Returns the mixed precision context for the network's forward pass,
+which is disabled on the CPU
+        """
+        return torch.autocast(device_type=self.device.type,
+                              dtype=self.amp_dtype,
+                              enabled=self.amp_dtype is not None)
+
+    def toTensor(self, batch):
+        """
+        Wraps a stacked batch as a float tensor. On CUDA it is placed in
+pinned memory, so its copy to the device does not block the host
+        """
+        tensor = torch.from_numpy(batch.astype(np.float32, copy=False))
+        if self.device.type == "cuda":
+            tensor = tensor.pin_memory()
+        return tensor
+
     def toTorch(self, arr):
-        torch_arr = arr.astype(np.float)
-        torch_arr = torch_arr.reshape(1, *torch_arr.shape)
-        return torch_arr    
+        torch_arr = np.ascontiguousarray(arr, dtype=np.float32)
+        return torch_arr[np.newaxis]    
     
     def run_epoch(self, sample_batch):
         """
@@ -85,37 +137,50 @@ class Trainer(object):
 
         """
                 
-        inputs = Variable(sample_batch[0]).float()
-        labels = Variable(sample_batch[1]).float()
-
-        inputs, labels = inputs.to(self.device), labels.to(self.device)
+        # Cast while copying to the device instead of allocating a float copy first
+        inputs = sample_batch[0].to(self.device, dtype=torch.float32,
+                                    memory_format=self.memory_format,
+                                    non_blocking=True)
+        labels = sample_batch[1].to(self.device, dtype=torch.float32,
+                                    non_blocking=True)
         
         self.optimizer.zero_grad()
 
-        outputs = self.net(inputs)
-        
-        loss = self.criterion(torch.cat(outputs), labels.long())
-        _, prediction = torch.max(torch.cat(outputs), 1)
+        with self.autocast():
+            outputs = self.compiled_net(inputs)
+
+            # Concatenate the output layers once rather than for every use
+            outputs = torch.cat(outputs)
+            loss = self.criterion(outputs, labels.long())
+
+        _, prediction = torch.max(outputs, 1)
         accuracy = torch.sum((prediction > 0) & (prediction==labels.long())).float()
         accuracy /= torch.sum((prediction > 0) | (labels > 0)).float()
         loss_hist = loss.cpu().item()
-        loss.backward()
-        self.optimizer.step()
+        if self.scaler is not None:
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+        else:
+            loss.backward()
+            self.optimizer.step()
         
         return loss_hist, accuracy.cpu().item()
     
     def evaluate(self, batch):       
         
-        with torch.no_grad():
-            inputs = Variable(batch[0]).float()
-            labels = Variable(batch[1]).float()
-
-            inputs, labels = inputs.to(self.device), labels.to(self.device)
+        with torch.no_grad(), self.autocast():
+            inputs = batch[0].to(self.device, dtype=torch.float32,
+                                 memory_format=self.memory_format,
+                                 non_blocking=True)
+            labels = batch[1].to(self.device, dtype=torch.float32,
+                                 non_blocking=True)
             
-            outputs = self.net(inputs)
+            outputs = self.compiled_net(inputs)
             
-            loss = self.criterion(torch.cat(outputs), labels.long())
-            _, prediction = torch.max(torch.cat(outputs), 1)
+            output = torch.cat(outputs)
+            loss = self.criterion(output, labels.long())
+            _, prediction = torch.max(output, 1)
             accuracy = torch.sum((prediction > 0) & (prediction==labels.long())).float()
             accuracy /= torch.sum((prediction > 0) | (labels > 0)).float()
             
@@ -123,7 +188,7 @@ class Trainer(object):
                 self.max_accuracy = accuracy
                 self.save_checkpoint("best.ckpt")
         
-        return loss.cpu().item(), accuracy.cpu().item(), torch.stack(outputs).cpu().numpy()
+        return loss.cpu().item(), accuracy.cpu().item(), torch.stack(outputs).float().cpu().numpy()
     
     def run_training(self):
         """
@@ -147,14 +212,14 @@ class Trainer(object):
                     break
 
                 print("Iteration: {}".format(num_iter))
-                train_loss, train_acc = self.run_epoch([torch.from_numpy(batch.astype(np.float)) for batch in sample_batch])
+                train_loss, train_acc = self.run_epoch([self.toTensor(batch) for batch in sample_batch])
                 if num_iter % self.checkpoint_period == 0:
                     self.save_checkpoint("iteration_{}.ckpt".format(num_iter))
                 
                 if num_iter % 10 == 0:
                     val_batch = [np.stack([self.toTorch(self.inputs_volume[1][idx]) for idx in val_idx[:16]]),
                                  np.stack([self.labels_volume[1][idx] for idx in val_idx[:16]])] 
-                    loss, accuracy, _ = self.evaluate([torch.from_numpy(batch.astype(np.float)) for batch in val_batch])
+                    loss, accuracy, _ = self.evaluate([self.toTensor(batch) for batch in val_batch])
                     self.logger.info("Iteration: {}, Epoch: {}/{}, Train loss: {:.4f}, Train acc: {:.2f}, Test loss: {:.4f}, Test acc: {:.2f}".format(num_iter, num_epoch, self.max_epochs, train_loss, train_acc*100, loss, accuracy*100))
                     
                 num_iter += 1
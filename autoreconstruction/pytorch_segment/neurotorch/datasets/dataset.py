@@ -1,11 +1,94 @@
+import torch
 from torch.utils.data import Dataset as _Dataset
 import numpy as np
 from abc import abstractmethod
-from autoreconstruction.pytorch_segment.neurotorch.datasets.datatypes import BoundingBox, Vector
+from autoreconstruction.pytorch_segment.neurotorch.datasets.datatypes import BoundingBox, BoundingBoxArray, Vector
 from numbers import Number
 from numpy import ndarray
-from scipy.spatial import KDTree
-from functools import reduce
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import mmap
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, Array.blend falls back to NumPy without it
+    njit = None
+
+
+if njit is not None:
+    @njit(nogil=True, cache=True)
+    def _blend(destination, source):
+        """
+        Takes the elementwise maximum of two equally shaped 3D arrays in
+place. The GIL is released so volumes can be blended from several threads
+        """
+        for z in range(source.shape[0]):
+            for y in range(source.shape[1]):
+                for x in range(source.shape[2]):
+                    if source[z, y, x] > destination[z, y, x]:
+                        destination[z, y, x] = source[z, y, x]
+
+    @njit(nogil=True, cache=True)
+    def _validTiles(array, starts, size):
+        """
+        Flags the tiles of a 3D array that contain any nonzero voxel. Tile
+corners are given in (Z, Y, X) array coordinates and tiles are clipped to
+the array. Each tile's scan stops at its first nonzero voxel
+        """
+        valid = np.zeros(starts.shape[0], dtype=np.bool_)
+        for i in range(starts.shape[0]):
+            z1, y1, x1 = max(starts[i, 0], 0), max(starts[i, 1], 0), max(starts[i, 2], 0)
+            z2 = min(starts[i, 0] + size[0], array.shape[0])
+            y2 = min(starts[i, 1] + size[1], array.shape[1])
+            x2 = min(starts[i, 2] + size[2], array.shape[2])
+            for z in range(z1, z2):
+                for y in range(y1, y2):
+                    for x in range(x1, x2):
+                        if array[z, y, x] != 0:
+                            valid[i] = True
+                            break
+                    if valid[i]:
+                        break
+                if valid[i]:
+                    break
+        return valid
+
+    @njit(nogil=True, cache=True)
+    def _gatherTiles(array, starts, out, pad_value):
+        """
+        Copies the tiles of a 3D array with the given (Z, Y, X) corners into a
+(B, 1, Z, Y, X) batch, writing the padding value wherever a tile extends past
+the array
+        """
+        for i in range(starts.shape[0]):
+            for z in range(out.shape[2]):
+                sz = starts[i, 0] + z
+                for y in range(out.shape[3]):
+                    sy = starts[i, 1] + y
+                    for x in range(out.shape[4]):
+                        sx = starts[i, 2] + x
+                        if (0 <= sz < array.shape[0] and 0 <= sy < array.shape[1]
+                                and 0 <= sx < array.shape[2]):
+                            out[i, 0, z, y, x] = array[sz, sy, sx]
+                        else:
+                            out[i, 0, z, y, x] = pad_value
+
+    @njit(nogil=True, cache=True)
+    def _blendTiles(array, starts, tiles):
+        """
+        Takes the elementwise maximum of a 3D array and a batch of (B, Z, Y, X)
+tiles with the given (Z, Y, X) corners in place, skipping wherever a tile
+extends past the array
+        """
+        for i in range(starts.shape[0]):
+            z0, y0, x0 = starts[i, 0], starts[i, 1], starts[i, 2]
+            for z in range(max(-z0, 0), min(tiles.shape[1], array.shape[0] - z0)):
+                for y in range(max(-y0, 0), min(tiles.shape[2], array.shape[1] - y0)):
+                    for x in range(max(-x0, 0), min(tiles.shape[3], array.shape[2] - x0)):
+                        if tiles[i, z, y, x] > array[z0 + z, y0 + y, x0 + x]:
+                            array[z0 + z, y0 + y, x0 + x] = tiles[i, z, y, x]
 
 
 class Data:
@@ -76,11 +159,39 @@ location in 3D-space
         return Data(self.getArray() + other.getArray(),
                     self.getBoundingBox())
 
+    def __iadd__(self, other):
+        """
+        Adds another data packet into this one in place. Data packets returned
+by Array.get may be views of the volume, in which case the volume changes too
+        """
+        if not isinstance(other, Data):
+            raise ValueError("other must have type Data")
+        if self.getBoundingBox() != other.getBoundingBox():
+            raise ValueError("other must have the same bounding box")
+
+        np.add(self.getArray(), other.getArray(), out=self.getArray())
+        return self
+
     def __sub__(self, other):
-        return self + (-other)
+        if not isinstance(other, Data):
+            raise ValueError("other must have type Data")
+        if self.getBoundingBox() != other.getBoundingBox():
+            raise ValueError("other must have the same bounding box")
+
+        return Data(self.getArray() - other.getArray(),
+                    self.getBoundingBox())
+
+    def __isub__(self, other):
+        if not isinstance(other, Data):
+            raise ValueError("other must have type Data")
+        if self.getBoundingBox() != other.getBoundingBox():
+            raise ValueError("other must have the same bounding box")
+
+        np.subtract(self.getArray(), other.getArray(), out=self.getArray())
+        return self
 
     def __neg__(self):
-        return (self * -1)
+        return Data(-self.getArray(), self.getBoundingBox())
 
     def __mul__(self, other):
         if not isinstance(other, Number):
@@ -91,6 +202,15 @@ location in 3D-space
         return Data(self.getArray() * other,
                     self.getBoundingBox())
 
+    def __imul__(self, other):
+        if not isinstance(other, Number):
+            error_string = "other must be a number instead it is a {}"
+            error_string = error_string.format(type(other))
+            raise ValueError(error_string)
+
+        np.multiply(self.getArray(), other, out=self.getArray())
+        return self
+
     def __div__(self, other):
         if not isinstance(other, Number):
             error_string = "other must be a number instead it is a {}"
@@ -99,11 +219,41 @@ location in 3D-space
 
         return (self * (1/other))
 
+    # Python 3 looks up __truediv__ for /, __div__ is only used by Python 2
+    __truediv__ = __div__
+
+    def __itruediv__(self, other):
+        if not isinstance(other, Number):
+            error_string = "other must be a number instead it is a {}"
+            error_string = error_string.format(type(other))
+            raise ValueError(error_string)
+
+        np.divide(self.getArray(), other, out=self.getArray())
+        return self
+
+    def blend(self, other):
+        """
+        Takes the elementwise maximum of this data packet and another one in
+place, without allocating a new array
+
+        :param other: A data packet with the same bounding box
+        """
+        if not isinstance(other, Data):
+            raise ValueError("other must have type Data")
+        if self.getBoundingBox() != other.getBoundingBox():
+            raise ValueError("other must have the same bounding box")
+
+        np.maximum(self.getArray(), other.getArray(), out=self.getArray())
+        return self
+
 
 class Array:
     """
     A dataset containing a 3D volumetric array
     """
+    # The value samples that extend past the volume are padded with
+    pad_value = 0
+
     def __init__(self, array: np.ndarray, bounding_box: BoundingBox=None,
                  iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
                                                          Vector(128, 128, 32)),
@@ -153,9 +303,14 @@ not exist, then the method raises a ValueError.
         after_pad = bounding_box.getEdges()[1] - sub_bounding_box.getEdges()[1]
 
         if before_pad != Vector(0, 0, 0) or after_pad != Vector(0, 0, 0):
-            pad_size = tuple(zip(before_pad.getNumpyDim(),
-                                 after_pad.getNumpyDim()))
-            array = np.pad(array, pad_width=pad_size, mode="constant")
+            # Fill once and copy the interior in, rather than letting np.pad
+            # concatenate along each axis
+            padded = np.full(bounding_box.getNumpyDim(), self.getPadValue(),
+                             dtype=array.dtype)
+            z1, y1, x1 = (-before_pad).getNumpyDim()
+            z2, y2, x2 = z1 + array.shape[0], y1 + array.shape[1], x1 + array.shape[2]
+            padded[z1:z2, y1:y2, x1:x2] = array
+            array = padded
 
         return Data(array, bounding_box)
 
@@ -189,14 +344,74 @@ given data.
         Blends a section of the volume within the provided bounding box with
 the given data by taking the elementwise maximum value.
 
-        :param data: The data packet to blend into the volume
+        :param data: The data packet to blend into the volume. Packets that
+extend past the volume, such as padded edge samples, are clipped to it
+        """
+        sub_bounding_box, data_array = self._clip(data)
+        array = self.getArray(sub_bounding_box)
+
+        data_array = data_array.astype(array.dtype, copy=False)
+        if njit is not None:
+            _blend(array, data_array)
+        else:
+            np.maximum(array, data_array, out=array)
+
+    def blendBatch(self, arrays, bounding_boxes: list):
+        """
+        Blends a batch of equally sized samples into the volume by taking the
+elementwise maximum value. With numba the whole batch is blended in one call
+rather than one data packet at a time
+
+        :param arrays: A (B, Z, Y, X) array of samples
+        :param bounding_boxes: The bounding box of each sample
+        """
+        if njit is None:
+            for array, bounding_box in zip(arrays, bounding_boxes):
+                self.blend(Data(array, bounding_box))
+            return
+
+        _blendTiles(self.array, self._batchStarts(arrays, bounding_boxes), arrays)
+
+    def _batchStarts(self, arrays, bounding_boxes: list) -> np.ndarray:
+        """
+        Computes the first corner of every sample in a batch, checking that
+each bounding box matches the size of the samples
+
+        :return: A (B, 3) array of corners in (Z, Y, X) array coordinates
+        """
+        if isinstance(bounding_boxes, BoundingBoxArray):
+            edges = bounding_boxes.getEdges()
+        else:
+            edges = np.array([[edge.getComponents() for edge in bounding_box.getEdges()]
+                              for bounding_box in bounding_boxes]).reshape(-1, 2, 3)
+        if (edges[:, 1] - edges[:, 0] != tuple(arrays.shape[1:])[::-1]).any():
+            raise ValueError("The data must match its bounding box size")
+
+        origin = np.array(self.getBoundingBox().getEdges()[0].getComponents())
+
+        return np.ascontiguousarray((edges[:, 0] - origin)[:, ::-1])
+
+    def _clip(self, data: Data):
         """
-        array = self.get(data.getBoundingBox()).getArray()
-        array = np.maximum(array, data.getArray())
+        Clips a data packet to the volume
 
-        result = Data(array, data.getBoundingBox())
+        :param data: The data packet to clip
+        :return: The bounding box of the clipped packet and its contents
+        """
+        data_array = data.getArray()
+        bounding_box = data.getBoundingBox()
+        if tuple(data_array.shape) != tuple(bounding_box.getNumpyDim()):
+            raise ValueError("The data must match its bounding box size")
+
+        sub_bounding_box = bounding_box.intersect(self.getBoundingBox())
+        if sub_bounding_box != bounding_box:
+            z1, y1, x1 = (sub_bounding_box.getEdges()[0]
+                          - bounding_box.getEdges()[0]).getNumpyDim()
+            z2, y2, x2 = (sub_bounding_box.getEdges()[1]
+                          - bounding_box.getEdges()[0]).getNumpyDim()
+            data_array = data_array[z1:z2, y1:y2, x1:x2]
 
-        self.set(result)
+        return sub_bounding_box, data_array
 
     def getArray(self, bounding_box: BoundingBox=None) -> np.ndarray:
         """
@@ -224,6 +439,31 @@ If the bounding box is outside of the volume, a ValueError is raised.
     def _setArray(self, array):
         self.array = array
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        # A memory-mapped file is sent to DataLoader workers started with
+        # spawn or forkserver by its path, so they map the same pages
+        # instead of each unpickling a copy of the whole stack
+        array = state.get("array")
+        if (isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap)
+                and array.filename is not None and array.flags.c_contiguous):
+            state["array"] = None
+            state["memmap"] = (array.filename, array.dtype, array.mode,
+                               array.offset, array.shape)
+
+        return state
+
+    def __setstate__(self, state):
+        memmap = state.pop("memmap", None)
+        if memmap is not None:
+            filename, dtype, mode, offset, shape = memmap
+            state["array"] = np.memmap(filename, dtype=dtype,
+                                       mode="r+" if mode == "w+" else mode,
+                                       offset=offset, shape=shape)
+
+        self.__dict__.update(state)
+
     def getBoundingBox(self) -> BoundingBox:
         """
         Retrieves the bounding box of the volume
@@ -281,6 +521,8 @@ origin
                                        self.getBoundingBox().getSize().getComponents(),
                                        self.iteration_size.getSize().getComponents(),
                                        self.stride.getComponents()))
+        self.length = (self.element_vec[0]*self.element_vec[1]
+                       * self.element_vec[2])
 
         self.index = 0
 
@@ -297,38 +539,290 @@ origin
     def getStride(self):
         return self.stride
 
+    def setPadValue(self, pad_value):
+        """
+        Sets the value samples that extend past the volume are padded with
+
+        :param pad_value: The padding value, 0 by default. Stacks that are
+inverted by the predictor are padded with 255, so their padding is black
+after the inversion as it is for stacks inverted on disk
+        """
+        self.pad_value = pad_value
+
+    def getPadValue(self):
+        return self.pad_value
+
     def __len__(self):
-        return self.element_vec[0]*self.element_vec[1]*self.element_vec[2]
+        return self.length
 
     def __getitem__(self, idx):
-        bounding_box = self._indexToBoundingBox(idx)
-        result = self.get(bounding_box)
-
-        return result
+        x1, y1, z1 = self._indexToCorner(idx)
+        lx, ly, lz = self.iteration_size.getSize().getComponents()
+        bounding_box = BoundingBox(Vector(x1, y1, z1),
+                                   Vector(x1+lx, y1+ly, z1+lz))
+
+        # Samples inside the array are sliced straight from their corner,
+        # only edge samples go through get's bounds checks and padding
+        ox, oy, oz = self.getBoundingBox().getEdges()[0].getComponents()
+        x, y, z = x1-ox, y1-oy, z1-oz
+        if x >= 0 and y >= 0 and z >= 0:
+            array = self.array[z:z+lz, y:y+ly, x:x+lx]
+            if array.shape == (lz, ly, lx):
+                return Data(array, bounding_box)
+
+        return self.get(bounding_box)
+
+    def _indexToCorner(self, idx):
+        """
+        Computes the first corner of a sample as plain integers
 
-    def _indexToBoundingBox(self, idx):
+        :param idx: The sample index
+        :return: The (X, Y, Z) corner of the sample
+        """
         if idx >= len(self):
             self.index = 0
             raise StopIteration
 
-        element_vec = np.unravel_index(idx,
-                                       shape=self.element_vec.getComponents())
+        # Samples step along X first, then Y, then Z, which matches the
+        # (Z, Y, X) memory layout, so consecutive samples share the same rows.
+        # Plain integer arithmetic is used as np.unravel_index is slow for a
+        # single index
+        ex, ey, _ = self.element_vec.getComponents()
+        iy, ix = divmod(idx, ex)
+        iz, iy = divmod(iy, ey)
 
-        element_vec = Vector(*element_vec)
-        bounding_box = self.iteration_size+self.stride*element_vec
+        sx, sy, sz = self.stride.getComponents()
+        ox, oy, oz = self.iteration_size.getEdges()[0].getComponents()
 
-        return bounding_box
+        return ox + ix*sx, oy + iy*sy, oz + iz*sz
+
+    def _indexToBoundingBox(self, idx):
+        # The edges are built from one corner array rather than validating
+        # two new vectors per sample
+        edge1 = Vector._fromArray(np.array(self._indexToCorner(idx)))
+        edge2 = edge1 + self.iteration_size.getSize()
+
+        return BoundingBox(edge1, edge2)
+
+    def _sampleStarts(self, indexes=None) -> np.ndarray:
+        """
+        Computes the first corner of several samples at once
+
+        :param indexes: The sample indexes, all samples are used if None
+        :return: An (N, 3) array of corners in (Z, Y, X) array coordinates
+        """
+        # Samples are ordered like _indexToBoundingBox, with X fastest. The
+        # first edge of the iteration size offsets every sample
+        counts = self.element_vec.getComponents()[::-1]
+        origin = np.array(self.getBoundingBox().getEdges()[0].getComponents())
+        origin = origin - self.iteration_size.getEdges()[0].getComponents()
+        stride = np.array(self.stride.getComponents())
+
+        if indexes is None:
+            # Each axis' starts are broadcast straight into the output, so no
+            # grid of element coordinates is materialized
+            starts = np.empty((*counts, 3), dtype=np.int64)
+            for axis, (count, step, first) in enumerate(zip(counts, stride[::-1],
+                                                            origin[::-1])):
+                shape = [1, 1, 1]
+                shape[axis] = count
+                starts[..., axis] = (np.arange(count)*step - first).reshape(shape)
+            return starts.reshape(-1, 3)
+
+        elements = np.stack(np.unravel_index(np.asarray(indexes), counts),
+                            axis=1)
+
+        return np.ascontiguousarray(elements*stride[::-1] - origin[::-1])
+
+    def getValidData(self) -> list:
+        """
+        Finds the samples of the volume that contain data
+
+        :return: The indexes of every sample that has a nonzero voxel
+        """
+        # Compute every sample corner at once instead of building a
+        # bounding box and data packet per sample
+        starts = self._sampleStarts()
+        size = self.iteration_size.getNumpyDim()
+
+        if njit is not None:
+            valid = _validTiles(self.array, starts, np.array(size))
+        else:
+            valid = self._validBlocks()
+            if valid is None:
+                valid = [self.array[max(z, 0):z+size[0], max(y, 0):y+size[1],
+                                    max(x, 0):x+size[2]].any()
+                         for z, y, x in starts]
+
+        return np.flatnonzero(valid).tolist()
+
+    def _validBlocks(self):
+        """
+        Flags the samples that contain data by reducing the array to one flag
+per stride-sized block, then combining the blocks each sample covers. Every
+voxel is read once however much the samples overlap
+
+        :return: The flag of every sample, or None if the sample size is not a
+multiple of the stride
+        """
+        size = np.array(self.iteration_size.getNumpyDim())
+        stride = np.array(self.stride.getComponents()[::-1])
+        if (stride <= 0).any() or (size % stride).any():
+            return None
+
+        counts = np.array(self.element_vec.getComponents()[::-1])
+        spans = size // stride
+        blocks_shape = counts - 1 + spans
+
+        # Nonzero voxels of the region the samples cover, which is zero where
+        # samples extend past the array
+        first = self._sampleStarts([0])[0]
+        region = np.zeros(blocks_shape*stride, dtype=bool)
+        src1 = np.maximum(first, 0)
+        src2 = np.minimum(first + region.shape, self.array.shape)
+        if (src2 > src1).all():
+            dst1, dst2 = src1 - first, src2 - first
+            region[dst1[0]:dst2[0], dst1[1]:dst2[1], dst1[2]:dst2[2]] = \
+                self.array[src1[0]:src2[0], src1[1]:src2[1], src1[2]:src2[2]] != 0
+
+        valid = region.reshape(blocks_shape[0], stride[0], blocks_shape[1],
+                               stride[1], blocks_shape[2], stride[2]).any(axis=(1, 3, 5))
+        for axis in range(3):
+            valid = np.logical_or.reduce([np.take(valid, range(offset, offset + counts[axis]),
+                                                  axis=axis)
+                                          for offset in range(spans[axis])])
+
+        return valid.reshape(-1)
+
+    def getBatch(self, indexes, out: np.ndarray) -> list:
+        """
+        Copies several samples into one batch array in a single pass, padding
+samples that extend past the volume with the padding value
+
+        :param indexes: The indexes of the samples
+        :param out: A (B, 1, Z, Y, X) array to fill with the samples
+        :return: The bounding boxes of the samples, as one array of edges
+        """
+        starts = self._sampleStarts(indexes)
+        size = self.iteration_size.getNumpyDim()
+
+        if njit is not None:
+            _gatherTiles(self.array, starts, out, self.getPadValue())
+        else:
+            for i, (z, y, x) in enumerate(starts):
+                z1, y1, x1 = max(z, 0), max(y, 0), max(x, 0)
+                tile = self.array[z1:z+size[0], y1:y+size[1], x1:x+size[2]]
+                if tile.shape != tuple(size):
+                    out[i].fill(self.getPadValue())
+                out[i, 0, z1-z:z1-z+tile.shape[0], y1-y:y1-y+tile.shape[1],
+                     x1-x:x1-x+tile.shape[2]] = tile
+
+        # The edges are the starts back in (X, Y, Z) order, without the
+        # origin offset, as in _indexToBoundingBox
+        origin = np.array(self.getBoundingBox().getEdges()[0].getComponents())
+        edge1 = starts[:, ::-1] + origin
+        edge2 = edge1 + self.iteration_size.getSize().getComponents()
+
+        return BoundingBoxArray(np.stack((edge1, edge2), axis=1))
 
     def __enter__(self):
         pass
 
-    def __exit__(self):
+    def __exit__(self, exc_type, exc_value, traceback):
         pass
 
 
+class CudaArray(Array):
+    """
+    A 3D volumetric array held in GPU memory as a torch tensor. Predictions
+are blended on the device and the volume is copied back to the host once.
+Only blending and toArray are supported
+    """
+    def __init__(self, array, bounding_box: BoundingBox=None,
+                 iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(128, 128, 32)),
+                 stride: Vector=Vector(64, 64, 16), device=None):
+        """
+        Initializes a GPU volume with a bounding box and iteration parameters
+
+        :param array: A 3D Numpy array or torch tensor
+        :param bounding_box: The bounding box encompassing the volume
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        :param device: The CUDA device the volume is held on
+        """
+        if not isinstance(array, (np.ndarray, torch.Tensor)):
+            raise ValueError("array must be an ndarray or a Tensor")
+
+        self._setArray(torch.as_tensor(array, device=device))
+        self.setBoundingBox(bounding_box)
+        self.setIteration(iteration_size=iteration_size,
+                          stride=stride)
+
+    def blend(self, data: Data):
+        """
+        Blends a section of the volume within the provided bounding box with
+the given data by taking the elementwise maximum value on the device
+
+        :param data: The data packet to blend into the volume, its contents
+may be a Numpy array or a tensor
+        """
+        sub_bounding_box, data_array = self._clip(data)
+        array = self.getArray(sub_bounding_box)
+
+        data_array = torch.as_tensor(data_array, device=array.device)
+        torch.maximum(array, data_array.to(array.dtype), out=array)
+
+    def blendBatch(self, arrays, bounding_boxes: list):
+        """
+        Blends a batch of equally sized samples into the volume on the device.
+The slices of every sample are computed at once, so each sample only costs
+one maximum kernel
+
+        :param arrays: A (B, Z, Y, X) array or tensor of samples
+        :param bounding_boxes: The bounding box of each sample
+        """
+        starts = self._batchStarts(arrays, bounding_boxes)
+        arrays = torch.as_tensor(arrays, device=self.array.device)
+
+        firsts = np.maximum(starts, 0).tolist()
+        lasts = np.minimum(starts + arrays.shape[1:], self.array.shape).tolist()
+        for array, (z, y, x), (z1, y1, x1), (z2, y2, x2) in zip(arrays, starts.tolist(),
+                                                                firsts, lasts):
+            if z2 <= z1 or y2 <= y1 or x2 <= x1:
+                continue
+
+            destination = self.array[z1:z2, y1:y2, x1:x2]
+            source = array[z1-z:z2-z, y1-y:y2-y, x1-x:x2-x]
+            torch.maximum(destination, source.to(destination.dtype),
+                          out=destination)
+
+    def toArray(self) -> Array:
+        """
+        Copies the volume to the host
+
+        :return: An Array with the volume's contents and iteration parameters
+        """
+        return Array(self.getArray().cpu().numpy(),
+                     bounding_box=self.getBoundingBox(),
+                     iteration_size=self.getIterationSize(),
+                     stride=self.getStride())
+
+
 class TorchVolume(_Dataset):
-    def __init__(self, volume):
+    def __init__(self, volume, cache_size: int=0):
+        """
+        Wraps a volume as a PyTorch dataset
+
+        :param volume: The volume to sample from
+        :param cache_size: The number of aligned samples to keep in memory
+after they are first read. The cache lives in shared memory, so it is filled
+once for all DataLoader workers and reused across epochs
+        """
         self.setVolume(volume)
+        self.setCache(cache_size)
         super().__init__()
 
     def __len__(self):
@@ -336,16 +830,58 @@ class TorchVolume(_Dataset):
 
     def __getitem__(self, idx):
         if isinstance(self.getVolume(), AlignedVolume):
-            data_list = [self.toTorch(data) for data in self.getVolume()[idx]]
-            return data_list
+            if idx < self.cache_size:
+                if not self.cached[idx]:
+                    # The sample is converted straight into the shared
+                    # cache instead of through a temporary array
+                    self._alignedSample(idx, out=self.cache[idx].numpy())
+                    self.cached[idx] = True
+                return list(self.cache[idx].numpy())
+
+            return list(self._alignedSample(idx))
         else:
             return self.getVolume()[idx].getArray()
 
-    def toTorch(self, data):
-        torch_data = data.getArray().astype(np.float)
-        torch_data = torch_data.reshape(1, *torch_data.shape)
+    def _alignedSample(self, idx, out=None):
+        # Aligned samples share a shape, so they are converted into one
+        # contiguous allocation and returned as views into it
+        data_list = self.getVolume()[idx]
+        torch_data = out
+        if torch_data is None:
+            torch_data = np.empty((len(data_list), 1,
+                                   *data_list[0].getArray().shape),
+                                  dtype=np.float32)
+        for i, data in enumerate(data_list):
+            np.copyto(torch_data[i, 0], data.getArray())
         return torch_data
 
+    def setCache(self, cache_size: int=0):
+        """
+        Allocates the shared memory sample cache. Since dataset indices are
+shuffled every epoch, caching the first cache_size indices keeps a random
+subset of samples in memory
+
+        :param cache_size: The number of samples to cache
+        """
+        self.cache_size = 0
+        self.cache = None
+        self.cached = None
+
+        if cache_size > 0 and isinstance(self.getVolume(), AlignedVolume):
+            self.cache_size = min(cache_size, len(self))
+            shape = self._alignedSample(0).shape
+            self.cache = torch.empty((self.cache_size, *shape),
+                                     dtype=torch.float32).share_memory_()
+            self.cached = torch.zeros(self.cache_size,
+                                      dtype=torch.bool).share_memory_()
+
+    def getCache(self):
+        return self.cache
+
+    def toTorch(self, data):
+        torch_data = np.ascontiguousarray(data.getArray(), dtype=np.float32)
+        return torch_data[np.newaxis]
+
     def setVolume(self, volume):
         self.volume = volume
 
@@ -406,6 +942,8 @@ class Volume:
                                        self.getBoundingBox().getSize().getComponents(),
                                        self.iteration_size.getSize().getComponents(),
                                        self.stride.getComponents()))
+        self.length = (self.element_vec[0]*self.element_vec[1]
+                       * self.element_vec[2])
 
         self.index = 0
 
@@ -483,7 +1021,7 @@ given data.
 
         :return: The dataset length
         """
-        return self.element_vec[0]*self.element_vec[1]*self.element_vec[2]
+        return self.length
 
     def __getitem__(self, idx: int):
         """
@@ -515,11 +1053,8 @@ given data.
             raise StopIteration
 
     def getValidData(self):
-        if self.valid_data is not None:
-            self.valid_data = []
-            for i in range(len(self)):
-                if not (self[i].getArray() == 0).all():
-                    self.valid_data.append(i)
+        if self.valid_data is None:
+            self.valid_data = self.getArray().getValidData()
 
         return self.valid_data
 
@@ -567,10 +1102,7 @@ class AlignedVolume(Volume):
 
     def getValidData(self):
         if self.valid_data is None:
-            self.valid_data = []
-            for i in range(len(self)):
-                if not (self.getVolumes()[1][i].getArray() == 0).all():
-                    self.valid_data.append(i)
+            self.valid_data = self.getVolumes()[1].getValidData()
 
         return self.valid_data
 
@@ -585,12 +1117,8 @@ class PooledVolume(Volume):
                  iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
                                                          Vector(128, 128, 32)),
                  stride: Vector=Vector(64, 64, 16)):
-        if volumes is not None:
-            self.volumes = volumes
-            self.volumes_changed = True
-        else:
-            self.volumes = []
-            self.volumes_changed = False
+        self.volumes = volumes if volumes is not None else []
+        self.volumes_changed = True
 
         self.volume_list = []
         self.setStack(stack_size)
@@ -599,27 +1127,70 @@ class PooledVolume(Volume):
 
         self.valid_data = None
 
+        # Threads that copy tiles into get's output, started on first use
+        self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["pool"] = None
+
+        return state
+
     def setStack(self, stack_size: int=15):
-        self.stack = []
+        # Loaded volumes keyed by index, from least to most recently used
+        self.stack = OrderedDict()
         self.stack_size = stack_size
 
     def _pushStack(self, index, volume):
         if len(self.stack) >= self.stack_size:
-            self.stack[0][1].__exit__(None, None, None)
-            self.stack.pop(0)
+            _, evicted = self.stack.popitem(last=False)
+            evicted.__exit__(None, None, None)
 
-        pos = len(self.stack)
-        self.stack.insert(pos, (index, volume.__enter__()))
+        volume.__enter__()
+        self.stack[index] = volume
 
-        return pos
+        return volume
 
-    def _rebuildIndexes(self):
-        edge1_list = [volume.getBoundingBox().getEdges()[0].getComponents()
-                      for volume in self.volumes]
+    def _getStack(self, index):
+        """
+        Retrieves a loaded volume, loading it into the stack if necessary
 
-        self.edge1_list = KDTree(edge1_list)
+        :param index: The index of the volume
+        """
+        volume = self.stack.get(index)
+        if volume is None:
+            return self._pushStack(index, self.volumes[index])
+
+        self.stack.move_to_end(index)
+        return volume
 
-        self.__len__()
+    def _rebuildIndexes(self):
+        # Keep both edges of every volume as (N, 3) arrays so a query can test
+        # intersection against all volumes at once
+        self.edge1_list = np.array([volume.getBoundingBox().getEdges()[0].getComponents()
+                                    for volume in self.volumes]).reshape(-1, 3)
+        self.edge2_list = np.array([volume.getBoundingBox().getEdges()[1].getComponents()
+                                    for volume in self.volumes]).reshape(-1, 3)
+
+        # Volumes of one size laid out on a regular grid, the usual case for
+        # tiled stacks, are also hashed by grid cell so a query only looks up
+        # the cells it spans
+        self.grid = None
+        sizes = self.edge2_list - self.edge1_list
+        if len(sizes) > 0 and (sizes == sizes[0]).all() and (sizes[0] > 0).all():
+            self.grid_origin = self.edge1_list.min(axis=0)
+            self.grid_size = sizes[0]
+            cells, offsets = np.divmod(self.edge1_list - self.grid_origin,
+                                       self.grid_size)
+            if not offsets.any():
+                self.grid = {}
+                for index, cell in enumerate(map(tuple, cells.tolist())):
+                    self.grid.setdefault(cell, []).append(index)
+
+        self.volume_index = [0]
+        for volume in self.volumes:
+            self.volume_index.append(self.volume_index[-1] + len(volume))
+        self.length = self.volume_index[-1]
 
         self.volumes_changed = False
 
@@ -627,16 +1198,40 @@ class PooledVolume(Volume):
         if self.volumes_changed:
             self._rebuildIndexes()
 
-        edge1 = [bounding_box.getEdges()[0].getComponents()]
-        distances, indexes  = self.edge1_list.query(edge1, k=8)
-        indexes = [index for index, dist in zip(indexes[0], distances[0])
-                   if dist < float('Inf')]
-        indexes = filter(lambda index: not bounding_box.isDisjoint(self.volumes[index].getBoundingBox()),
-                         indexes)
+        if self.grid is not None:
+            indexes = self._queryGrid(bounding_box)
+        else:
+            edge1, edge2 = [np.array(edge.getComponents())
+                            for edge in bounding_box.getEdges()]
+            intersecting = ((edge1 <= self.edge2_list).all(axis=1)
+                            & (edge2 >= self.edge1_list).all(axis=1))
+            indexes = np.flatnonzero(intersecting).tolist()
+
         if not indexes:
             raise IndexError("bounding_box is not present in any indexes")
 
-        return list(indexes)
+        return indexes
+
+    def _queryGrid(self, bounding_box: BoundingBox) -> list:
+        """
+        Finds the volumes touching a bounding box from the grid cells it
+spans. Cells touching the bounding box on a face count, as they do for the
+intersection test
+        """
+        ranges = []
+        for q1, q2, origin, size in zip(bounding_box.getEdges()[0].getComponents(),
+                                        bounding_box.getEdges()[1].getComponents(),
+                                        self.grid_origin.tolist(),
+                                        self.grid_size.tolist()):
+            first = -((origin + size - q1)//size)
+            last = (q2 - origin)//size
+            ranges.append(range(first, last+1))
+
+        indexes = [index
+                   for x in ranges[0] for y in ranges[1] for z in ranges[2]
+                   for index in self.grid.get((x, y, z), ())]
+
+        return sorted(indexes)
 
     def add(self, volume: Volume):
         self.volumes_changed = True
@@ -646,54 +1241,60 @@ class PooledVolume(Volume):
         indexes = self._queryBoundingBox(bounding_box)
 
         data = []
-
-        stack_volumes = [volume for i, volume in self.stack if i in indexes]
-        stack_disjoint = list(set(indexes) - set([i for i, v in self.stack]))
-
-        for volume in stack_volumes:
-            sub_bbox = bounding_box.intersect(volume.getBoundingBox())
-            data.append(volume.get(sub_bbox))
-
-        for index in stack_disjoint:
-            volume = self.volumes[index]
-            i = self._pushStack(index, volume)
+        for index in indexes:
+            volume = self._getStack(index)
 
             sub_bbox = bounding_box.intersect(volume.getBoundingBox())
             data.append(volume.get(sub_bbox))
 
         shape = bounding_box.getNumpyDim()
-        array = Array(np.zeros(shape).astype(np.uint16),
+        array = Array(np.zeros(shape, dtype=np.uint16),
                         bounding_box=bounding_box,
                         iteration_size=BoundingBox(Vector(0, 0, 0),
                                                     bounding_box.getSize()),
                         stride=bounding_box.getSize())
-        [array.set(item) for item in data]
+
+        # Copies into disjoint regions of the output are independent and
+        # NumPy releases the GIL while copying, so they can run on threads.
+        # Overlapping tiles are set serially to keep the last write winning
+        bounding_boxes = BoundingBoxArray.fromBoundingBoxes(
+            [item.getBoundingBox() for item in data])
+        if len(data) > 1 and not bounding_boxes.isOverlapping():
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=8)
+            list(self.pool.map(array.set, data))
+        else:
+            [array.set(item) for item in data]
         return Data(array.getArray(), bounding_box)
 
     def set(self, data: Data):
-        indexes = self._queryBoundingBox(data.getBoundingBox())
+        bounding_box = data.getBoundingBox()
+        indexes = self._queryBoundingBox(bounding_box)
 
-        data = []
+        array = Array(data.getArray(), bounding_box=bounding_box,
+                      iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                 bounding_box.getSize()),
+                      stride=bounding_box.getSize())
         for index in indexes:
-            for stack_index, stack_volume in self.stack:
-                if stack_index == index:
-                    stack_volume.set(data)
-                else:
-                    volume = self.volume_list[index].__enter__()
-                    self._pushStack(index, volume)
+            volume = self._getStack(index)
 
-                    volume.set(data)
+            sub_bbox = bounding_box.intersect(volume.getBoundingBox())
+            volume.set(array.get(sub_bbox))
 
     def __exit__(self, exc_type, exc_value, traceback):
-        for index, volume in self.stack:
-            volume.__exit__()
+        while self.stack:
+            _, volume = self.stack.popitem(last=False)
+            volume.__exit__(None, None, None)
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
     def __len__(self) -> int:
+        # Indexes are rebuilt once per change to the pool, not on every call,
+        # so per-sample lookups do not rescan every volume
         if self.volumes_changed:
-            self.volume_index = [0]
-            for volume in self.volumes:
-                self.volume_index.append(self.volume_index[-1] + len(volume))
-            self.length = self.volume_index[-1]
+            self._rebuildIndexes()
 
         return self.length
 
@@ -704,22 +1305,21 @@ class PooledVolume(Volume):
         return result
 
     def _indexToBoundingBox(self, idx: int) -> BoundingBox:
-        if self.volumes_changed:
-            len(self)
-
         if idx >= len(self):
             self.index = 0
             raise StopIteration
 
-        index = max(filter(lambda index: self.volume_index[index] <= idx,
-                           range(len(self.volume_index))))
+        # volume_index holds the cumulative start of each volume, so the last
+        # start at or below idx is found by bisection instead of a full scan
+        index = bisect_right(self.volume_index, idx) - 1
         volume = self.volumes[index]
         _idx = idx-self.volume_index[index]
 
-        element_vec = np.unravel_index(_idx,
-                                       shape=volume.element_vec.getComponents())
+        ex, ey, _ = volume.element_vec.getComponents()
+        iy, ix = divmod(_idx, ex)
+        iz, iy = divmod(iy, ey)
 
-        element_vec = Vector(*element_vec)
+        element_vec = Vector(ix, iy, iz)
         bounding_box = volume.iteration_size+volume.stride*element_vec \
                        + volume.getBoundingBox().getEdges()[0]
 
@@ -734,9 +1334,9 @@ class PooledVolume(Volume):
 
     def getValidData(self):
         if self.valid_data is None:
-            self.valid_data = []
-            for i in range(len(self)):
-                if not (self[i].getArray() == 0).all():
-                    self.valid_data.append(i)
+            # any() stops at the first nonzero voxel instead of comparing
+            # the whole sample to zero first
+            self.valid_data = [i for i in range(len(self))
+                               if self[i].getArray().any()]
 
         return self.valid_data
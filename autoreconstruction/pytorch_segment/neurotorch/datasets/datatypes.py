@@ -1,35 +1,66 @@
 from numbers import Number
+import numpy as np
 
 
 class Vector:
     """
-    A basic vector data type
+    A basic vector data type backed by a small NumPy array
     """
+    __slots__ = ("_arr", "_components")
+
     def __init__(self, *components: Number):
         """
         Initializes a vector
         :param components: Numbers specifying the components of the vector
         :type components: List of numbers
         """
-        self.setComponents(components)
-
-    def setComponents(self, components: list):
+        self._setComponents(components)
+
+    @classmethod
+    def _fromArray(cls, array):
+        # Wraps the result of an arithmetic operation without validating
+        # it again
+        vector = cls.__new__(cls)
+        array.flags.writeable = False
+        vector._arr = array
+        vector._components = None
+        return vector
+
+    def _setComponents(self, components: list):
         """
-        Set the components in a vector
+        Set the components in a vector. Vectors are hashable, so this is only
+called while one is built
         :param components: A list of numbers specifying the vector's 
 components
         :type components: List of numbers
         """
-        if not all(isinstance(x, Number) for x in components):
+        array = np.array(components)
+        if array.ndim != 1 or (array.size and array.dtype.kind not in "biuf"):
             raise ValueError("components must contain all numbers instead" +
                              " it contains {}".format(components))
-        self.components = tuple(components)
 
-    def getComponents(self) -> list:
+        # Integer components of any width are widened so that arithmetic
+        # never wraps around. Python ints already give int64, so the common
+        # case needs no second copy
+        if array.dtype.kind != "f" and array.dtype != np.int64:
+            array = array.astype(np.int64)
+
+        # Vectors are hashed by their components, so the array is read-only
+        array.flags.writeable = False
+        self._arr = array
+        self._components = None
+
+    @property
+    def components(self) -> tuple:
+        if self._components is None:
+            self._components = tuple(self._arr.tolist())
+        return self._components
+
+    def getComponents(self) -> tuple:
         """
         Retrieves the components of a vector
-        :return: A list of numbers specifying the vector's components
-        :rtype: List of numbers
+        :return: A tuple of numbers specifying the vector's components
+        :rtype: Tuple of numbers
         """
         return self.components
 
@@ -39,7 +70,7 @@ components
         :return: The vector's dimension
         :rtype: int
         """
-        return len(self.getComponents())
+        return len(self._arr)
 
     def getNumpyDim(self) -> list:
         """
@@ -67,55 +98,56 @@ components
                              + "self is {} and other is {}".format(self,
                                                                    other))
 
-        result = tuple(s + o for s, o in zip(self.getComponents(),
-                                             other.getComponents()))
-
-        return Vector(*result)
+        return Vector._fromArray(self._arr + other._arr)
 
     def __mul__(self, other):
-        if isinstance(other, Number):
-            result = [s * other for s in self.getComponents()]
-
-        elif isinstance(other, Vector):
-            result = [s*o for s, o in zip(self.getComponents(),
-                                          other.getComponents())]
+        if isinstance(other, Vector):
+            if self.getDimension() != other.getDimension():
+                raise ValueError("other must have the same dimension")
+            return Vector._fromArray(self._arr * other._arr)
 
-        else:
-            raise ValueError("other must be a number or a vector instead"
-                             " it is {}".format(type(other)))
+        if isinstance(other, Number):
+            return Vector._fromArray(self._arr * other)
 
-        return Vector(*result)
+        raise ValueError("other must be a number or a vector instead"
+                         " it is {}".format(type(other)))
 
     def __div__(self, other):
         if isinstance(other, Number):
             return self*(1/other)
 
         if isinstance(other, Vector):
-            result = Vector([1/o for o in other.getComponents()])
-            result *= self
-
-            return result
+            return Vector._fromArray(self._arr / other._arr)
 
     def __sub__(self, other):
-        return self+(other*-1)
-
-    def __neg__(self):
-        return self*-1
-
-    def __eq__(self, other):
         if not isinstance(other, Vector):
             raise ValueError("other must be a vector instead"
                              " it is {}".format(type(other)))
 
         if self.getDimension() != other.getDimension():
-            raise ValueError("other must have the same dimension")
+            raise ValueError("other must have the same dimension instead "
+                             + "self is {} and other is {}".format(self,
+                                                                   other))
 
-        return all(r1 == r2 for r1, r2 in zip(self.getComponents(),
-                                              other.getComponents()))
+        return Vector._fromArray(self._arr - other._arr)
+
+    def __neg__(self):
+        return Vector._fromArray(-self._arr)
+
+    def __eq__(self, other):
+        # Other types are left to Python, so a vector can share a dict or set
+        # with keys like the tuple of its own components
+        if not isinstance(other, Vector):
+            return NotImplemented
+
+        return self.getComponents() == other.getComponents()
 
     def __ne__(self, other):
         return not (self == other)
 
+    def __hash__(self):
+        return hash(self.getComponents())
+
     def __str__(self):
         return "{}".format(self.getComponents())
 
@@ -127,6 +159,8 @@ class BoundingBox:
     """
     A basic data type specifying a cube
     """
+    __slots__ = ("edge1", "edge2", "size", "numpy_dim")
+
     def __init__(self, edge1: Vector, edge2: Vector):
         """
         Initializes a bounding box
@@ -135,11 +169,12 @@ class BoundingBox:
         :param edge2: A vector specifying the second edge of the box
         :type edge2: Vector
         """
-        self.setEdges(edge1, edge2)
+        self._setEdges(edge1, edge2)
 
-    def setEdges(self, edge1: Vector, edge2: Vector):
+    def _setEdges(self, edge1: Vector, edge2: Vector):
         """
-        Sets the edges of the bounding box
+        Sets the edges of the bounding box. Bounding boxes are hashable, so
+this is only called while one is built
         :param edge1: A vector specifying the first edge of the box
         :type edge1: Vector
         :param edge2: A vector specifying the second edge of the box
@@ -156,6 +191,10 @@ class BoundingBox:
         self.edge1 = edge1
         self.edge2 = edge2
 
+        # The size is requested far more often than the edges are set
+        self.size = Vector._fromArray(edge2._arr - edge1._arr)
+        self.numpy_dim = self.size.getComponents()[::-1]
+
     def getEdges(self) -> tuple:
         """
         Returns the two edges for the bounding box
@@ -178,10 +217,7 @@ class BoundingBox:
         :return: The size of the bounding box
         :rtype: Vector
         """
-        edge1, edge2 = self.getEdges()
-        chunk_size = edge2 - edge1
-
-        return chunk_size
+        return self.size
 
     def getNumpyDim(self) -> list:
         """
@@ -189,7 +225,7 @@ class BoundingBox:
         :return: Size of the bounding box in row-major order (Z, Y, X)
         :rtype: list
         """
-        return self.getSize().getComponents()[::-1]
+        return self.numpy_dim
 
     def isDisjoint(self, other) -> bool:
         """
@@ -203,12 +239,8 @@ class BoundingBox:
             raise ValueError("other must be a vector instead other is "
                              "{}".format(type(other)))
 
-        result = any(r1 > r2 for r1, r2 in zip(self.getEdges()[0],
-                                               other.getEdges()[1]))
-        result |= any(r1 < r2 for r1, r2 in zip(self.getEdges()[1],
-                                                other.getEdges()[0]))
-
-        return result
+        return bool(((self.edge1._arr > other.edge2._arr) |
+                     (self.edge2._arr < other.edge1._arr)).any())
 
     def isSubset(self, other):
         """
@@ -223,17 +255,10 @@ class BoundingBox:
             raise ValueError("other must be a vector instead other is "
                              "{}".format(type(other)))
 
-        # Determines whether the first bounding box's components are
-        # less than or equal to the other's components
-        result = any(r1 <= r2 for r1, r2 in zip(self.getEdges()[1],
-                                                other.getEdges()[1]))
-
-        # Determines whether the first bounding box's components are
-        # greater than or equal to the other's components
-        result &= any(r1 >= r2 for r1, r2 in zip(self.getEdges()[0],
-                                                 other.getEdges()[0]))
-
-        return result
+        # Every component of the first edge must be at least the other's and
+        # every component of the second edge at most the other's
+        return bool(((self.edge1._arr >= other.edge1._arr) &
+                     (self.edge2._arr <= other.edge2._arr)).all())
 
     def isSuperset(self, other):
         """
@@ -255,22 +280,24 @@ bounding boxes
         :return: An bounding box intersecting the two bounding boxes
         :rtype: BoundingBox
         """
-        if self.isDisjoint(other):
-            raise ValueError("The bounding boxes must not be disjoint")
+        if not isinstance(other, BoundingBox):
+            raise ValueError("other must be a vector instead other is "
+                             "{}".format(type(other)))
 
         # The first edge contains the largest components of the first
         # edge of the two bounding boxes
-        edge1 = Vector(*map(lambda x, y: max(x, y),
-                            self.getEdges()[0].getComponents(),
-                            other.getEdges()[0].getComponents()))
+        edge1 = np.maximum(self.edge1._arr, other.edge1._arr)
 
         # The second edge contains the smallest components of the second
         # edge of the two bounding boxes
-        edge2 = Vector(*map(lambda x, y: min(x, y),
-                            self.getEdges()[1].getComponents(),
-                            other.getEdges()[1].getComponents()))
+        edge2 = np.minimum(self.edge2._arr, other.edge2._arr)
 
-        return BoundingBox(edge1, edge2)
+        # The boxes are disjoint exactly when these edges cross in some axis,
+        # so no separate isDisjoint pass is needed
+        if (edge1 > edge2).any():
+            raise ValueError("The bounding boxes must not be disjoint")
+
+        return BoundingBox(Vector._fromArray(edge1), Vector._fromArray(edge2))
 
     def __str__(self):
         edge1, edge2 = self.getEdges()
@@ -286,11 +313,11 @@ bounding boxes
         return result
 
     def __sub__(self, other):
-        return self.__add__(other*-1)
+        return self.__add__(-other)
 
     def __eq__(self, other):
         if not isinstance(other, BoundingBox):
-            raise ValueError("other must be a BoundingBox")
+            return NotImplemented
 
         s_edge1, s_edge2 = self.getEdges()
         o_edge1, o_edge2 = other.getEdges()
@@ -299,3 +326,80 @@ bounding boxes
 
     def __ne__(self, other):
         return not (self == other)
+
+    def __hash__(self):
+        return hash((self.edge1, self.edge2))
+
+
+class BoundingBoxArray:
+    """
+    A sequence of bounding boxes stored as one array of edges, so a batch of
+samples does not need a BoundingBox object per sample
+    """
+    __slots__ = ("edges",)
+
+    def __init__(self, edges):
+        """
+        Initializes a sequence of bounding boxes
+        :param edges: An (N, 2, D) array holding the first and second edge
+of each bounding box
+        :type edges: numpy.ndarray
+        """
+        self.setEdges(edges)
+
+    @classmethod
+    def fromBoundingBoxes(cls, bounding_boxes):
+        """
+        Stacks the edges of a list of bounding boxes
+        :param bounding_boxes: The bounding boxes, which share a dimension
+        """
+        return cls(np.array([[edge._arr for edge in bounding_box.getEdges()]
+                             for bounding_box in bounding_boxes],
+                            dtype=np.int64).reshape(len(bounding_boxes), 2, -1))
+
+    def setEdges(self, edges):
+        """
+        Sets the edges of the bounding boxes
+        :param edges: An (N, 2, D) array holding the first and second edge
+of each bounding box
+        :type edges: numpy.ndarray
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        if edges.ndim != 3 or edges.shape[1] != 2:
+            raise ValueError("edges must have shape (N, 2, D) instead it " +
+                             "has shape {}".format(edges.shape))
+        self.edges = edges
+
+    def getEdges(self) -> np.ndarray:
+        """
+        Returns the edges of every bounding box
+        :return: An (N, 2, D) array of edges
+        :rtype: numpy.ndarray
+        """
+        return self.edges
+
+    def isOverlapping(self) -> bool:
+        """
+        Checks whether any two of the bounding boxes share a voxel. Boxes that
+only touch on a face do not overlap
+        :return: True if any pair of bounding boxes overlaps
+        """
+        edge1, edge2 = self.edges[:, 0], self.edges[:, 1]
+        overlapping = ((edge1[:, np.newaxis] < edge2[np.newaxis]) &
+                       (edge1[np.newaxis] < edge2[:, np.newaxis])).all(axis=2)
+        np.fill_diagonal(overlapping, False)
+
+        return bool(overlapping.any())
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return BoundingBoxArray(self.edges[idx])
+
+        edge1, edge2 = self.edges[idx]
+        return BoundingBox(Vector._fromArray(edge1), Vector._fromArray(edge2))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
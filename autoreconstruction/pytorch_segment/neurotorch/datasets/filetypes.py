@@ -3,7 +3,6 @@ from autoreconstruction.pytorch_segment.neurotorch.datasets.datatypes import Bou
 from abc import abstractmethod
 import fnmatch
 import os.path
-import h5py
 import numpy as np
 import tifffile as tif
 
@@ -40,19 +39,27 @@ containing TIFF files
         if os.path.isfile(self.getFile()):
             try:
                 print("Opening {}".format(self.getFile()))
-                array = tif.imread(self.getFile())
+                # Memory-map uncompressed stacks so only the samples that are
+                # actually read are paged in, and load anything else in full
+                try:
+                    array = tif.memmap(self.getFile(), mode="r")
+                except ValueError:
+                    array = tif.imread(self.getFile())
 
             except IOError:
                 raise IOError("TIFF file {} could not be " +
                               "opened".format(self.getFile()))
 
         elif os.path.isdir(self.getFile()):
-            tiff_list = os.listdir(self.getFile())
-            tiff_list = filter(lambda f: fnmatch.fnmatch(f, '*.tif'),
-                               tiff_list)
+            tiff_list = [os.path.join(self.getFile(), f)
+                         for f in fnmatch.filter(os.listdir(self.getFile()),
+                                                 '*.tif')]
+            if not tiff_list:
+                raise IOError("{} contains no TIFF files".format(self.getFile()))
 
-            if tiff_list:
-                array = tif.TiffSequence(tiff_list).asarray()
+            # Slices are ordered by natural sort, so slice10 follows slice9,
+            # and read into one preallocated stack
+            array = tif.TiffSequence(tif.natural_sorted(tiff_list)).asarray()
 
         else:
             raise IOError("{} was not found".format(self.getFile()))
@@ -70,6 +77,9 @@ containing TIFF files
     def _indexToBoundingBox(self, idx):
         return self.getArray()._indexToBoundingBox(idx)
 
+    def getBatch(self, indexes, out):
+        return self.getArray().getBatch(indexes, out)
+
 
 class Hdf5Volume(Volume):
     def __init__(self, hdf5_file, dataset, bounding_box: BoundingBox,
@@ -101,13 +111,28 @@ volume dataset
         return self.hdf5_dataset
 
     def __enter__(self):
-        if os.path.isfile(self.getFile()):
-            with h5py.File(self.getFile(), 'r') as f:
-                array = f[self.getDataset()].value
-                array = Array(array, bounding_box=self.getBoundingBox(),
-                              iteration_size=self.getIterationSize(),
-                              stride=self.getStride())
-                self.setArray(array)
+        # h5py is only imported when an HDF5 volume is opened, so TIFF-only
+        # pipelines and their DataLoader workers never load it
+        import h5py
+
+        if not os.path.isfile(self.getFile()):
+            raise IOError("{} was not found".format(self.getFile()))
+
+        with h5py.File(self.getFile(), 'r') as f:
+            # Only the region covered by the bounding box is read from disk,
+            # instead of the whole dataset through the removed .value
+            size = self.getBoundingBox().getNumpyDim()
+            array = f[self.getDataset()][tuple(slice(0, n) for n in size)]
+
+        array = Array(array, bounding_box=self.getBoundingBox(),
+                      iteration_size=self.getIterationSize(),
+                      stride=self.getStride())
+        self.setArray(array)
+
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.setArray(None)
+
+    def getBatch(self, indexes, out):
+        return self.getArray().getBatch(indexes, out)
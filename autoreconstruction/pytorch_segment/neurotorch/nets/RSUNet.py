@@ -12,6 +12,7 @@ Based on an architecture by
 Kisuk Lee <kisuklee@mit.edu>, 2017
 """
 
+import torch
 from torch import nn
 from torch.nn import functional as F
 import neurotorch.nets.layers as layers
@@ -69,6 +70,22 @@ class ConvMod(nn.Module):
             self.bn2 = nn.BatchNorm3d(D_out, momentum=momentum)
             self.bn3 = nn.BatchNorm3d(D_out, momentum=momentum)
 
+    def fuse_for_inference(self):
+        """ Folds the batch norms that directly follow a conv into it """
+
+        if not self.bn or isinstance(self.bn1, nn.Identity):
+            return
+
+        layers.fuse_conv_bn(self.conv1, self.bn1)
+        layers.fuse_conv_bn(self.conv2, self.bn2)
+        self.bn1 = nn.Identity()
+        self.bn2 = nn.Identity()
+
+        # bn3 normalizes the residual sum, not the conv output
+        if not self.resid:
+            layers.fuse_conv_bn(self.conv3, self.bn3)
+            self.bn3 = nn.Identity()
+
     def forward(self, x):
 
         out1 = self.conv1(x)
@@ -158,7 +175,17 @@ class OutputModule(nn.Module):
             self.output_layers.append(name)
 
     def forward(self, x):
-        return [getattr(self, layer)(x) for layer in self.output_layers]
+        heads = [getattr(self, layer).conv for layer in self.output_layers]
+        if len(heads) == 1:
+            return [heads[0](x)]
+
+        # The heads share their input, so they run as one convolution over
+        # their stacked weights and the result is split per head
+        out = F.conv3d(x, torch.cat([head.weight for head in heads]),
+                       torch.cat([head.bias for head in heads]),
+                       heads[0].stride, heads[0].padding)
+        return list(torch.split(out, [head.out_channels for head in heads],
+                                dim=1))
 
 
 class RSUNet(nn.Module):
@@ -213,6 +240,14 @@ class RSUNet(nn.Module):
         self.outputdeconv = OutputModule(
             D_in, output_spec, ks=io_size, st=io_stride)
 
+    def fuse_for_inference(self):
+        """ Folds batch norms into the convs they follow for inference """
+
+        assert not self.training, "batch norms can only be fused in eval mode"
+        for module in self.modules():
+            if isinstance(module, ConvMod):
+                module.fuse_for_inference()
+
     def add_conv_mod(self, depth, D_in, D_out, ks, bn):
 
         setattr(self, "convmod{}".format(depth),
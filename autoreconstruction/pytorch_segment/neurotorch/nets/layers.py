@@ -11,25 +11,57 @@ Kisuk Lee <kisuklee@mit.edu>, 2016-2017
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn import init
+from functools import lru_cache
 import math
 
 
 def pad_size(ks, mode):
 
-    assert mode in ["valid", "same", "full"]
+    # Every conv module asks for the same few kernel sizes, so the padding
+    # is looked up instead of recomputed
+    return _pad_size(tuple(ks), mode)
+
+
+@lru_cache(maxsize=None)
+def _pad_size(ks, mode):
+
+    assert mode in ["valid", "same", "full"], \
+        "mode must be valid, same or full instead it is {}".format(mode)
 
     if mode == "valid":
         return (0, 0, 0)
 
     elif mode == "same":
-        assert all([x % 2 for x in ks])
+        assert all(x % 2 for x in ks), \
+            "same padding needs odd kernel sizes instead ks is {}".format(ks)
         return tuple(x // 2 for x in ks)
 
     elif mode == "full":
         return tuple(x - 1 for x in ks)
 
 
+def fuse_conv_bn(conv, bn):
+    """ Folds an inference mode BatchNorm3d into the convolution before it """
+
+    # Conv and FactConv wrap the convolution that produces their output
+    while not isinstance(conv, nn.Conv3d):
+        conv = conv.conv
+
+    with torch.no_grad():
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        shift = -bn.running_mean * scale
+        if bn.affine:
+            scale = scale * bn.weight
+            shift = shift * bn.weight + bn.bias
+
+        conv.weight.mul_(scale.reshape(-1, 1, 1, 1, 1))
+        if conv.bias is not None:
+            shift = shift + conv.bias * scale
+        conv.bias = nn.Parameter(shift)
+
+
 class Conv(nn.Module):
     """ Bare bones 3D convolution module w/ MSRA init """
 
@@ -41,7 +73,22 @@ class Conv(nn.Module):
         if bias:
             init.constant(self.conv.bias, 0)
 
+        # a conv with a depth 1 kernel is a 2D conv applied to every z slice
+        self.planar = (self.conv.kernel_size[0] == 1 and
+                       self.conv.stride[0] == 1 and self.conv.padding[0] == 0)
+
     def forward(self, x):
+
+        # In channels_last_3d, folding z into the batch is only a view, so
+        # planar convs run on cuDNN's better tuned 2D kernels without copies
+        if (self.planar and x.dim() == 5 and
+                x.is_contiguous(memory_format=torch.channels_last_3d)):
+            n, _, d, h, w = x.shape
+            planes = x.permute(0, 2, 1, 3, 4).reshape(n*d, -1, h, w)
+            out = F.conv2d(planes, self.conv.weight.squeeze(2), self.conv.bias,
+                           self.conv.stride[1:], self.conv.padding[1:])
+            return out.reshape(n, d, *out.shape[1:]).permute(0, 2, 1, 3, 4)
+
         return self.conv(x)
 
 
@@ -58,17 +105,19 @@ class FactConv(nn.Module):
             st = (st[0], 1, 1)
             pd = (pd[0], 0, 0)
 
+            # the second conv reads the factor's output
+            D_in = D_out
+
         else:
-            self.factor = None
+            # an identity factor keeps forward free of branches and adds no
+            # state_dict keys
+            self.factor = nn.Identity()
 
         self.conv = Conv(D_in, D_out, ks, st, pd, bias)
 
     def forward(self, x):
 
-        if self.factor is not None:
-            return self.conv(self.factor(x))
-        else:
-            return self.conv(x)
+        return self.conv(self.factor(x))
 
 
 class ConvT(nn.Module):
@@ -108,12 +157,13 @@ class Upsample2D(nn.Module):
         nn.Module.__init__(self)
 
         self.scale_factor = scale_factor
-        self.upsample = nn.Upsample(scale_factor=2, mode=mode)
+        # upsample in x and y only, so no z slices are made and discarded
+        self.upsample = nn.Upsample(scale_factor=(1, scale_factor, scale_factor),
+                                    mode=mode)
 
     def forward(self, x):
 
-        # upsample in all dimensions, and undo the z upsampling
-        return self.upsample(x)[:, :, ::self.scale_factor, :, :]
+        return self.upsample(x)
 
 
 class FactConvT(nn.Module):
@@ -129,14 +179,13 @@ class FactConvT(nn.Module):
             st = (st[0], 1, 1)
             pd = (pd[0], 0, 0)
 
+            D_in = D_out
+
         else:
-            self.factor = None
+            self.factor = nn.Identity()
 
         self.conv = ConvT(D_in, D_out, ks, st, pd, bias)
 
     def forward(self, x):
 
-        if self.factor is not None:
-            return self.conv(self.factor(x))
-        else:
-            return self.conv(x)
+        return self.conv(self.factor(x))
@@ -7,14 +7,19 @@ class NetCollector(object):
     """
     module_list = dict()
 
+    @classmethod
     def add_module(cls, module, identifier):
-        NetCollector.module_list[identifier] = module
+        cls.module_list[identifier] = module
 
+    @classmethod
     def get_module(cls, identifier):
-        importlib.import_module("neurotorch.nets." + identifier)
+        # Only import the architecture's module the first time it is requested,
+        # relative to this package so it works with either import path
+        if identifier not in cls.module_list:
+            importlib.import_module("." + identifier, __package__)
 
         try:
-            return NetCollector.module_list[identifier]
+            return cls.module_list[identifier]
         except KeyError:
-            raise ValueError("{} could not be found in the" +
-                             " NetCollector".format(identifier))
+            raise ValueError("{} could not be found in the".format(identifier) +
+                             " NetCollector")
@@ -8,11 +8,43 @@ import tifffile as tif
 import os
 import glob
 import argparse
+import queue
+import threading
+
+def write_tiffs(write_queue, errors):
+    # Write (path, image) pairs until a None is received, keeping the first
+    # error so it can be raised once the writer is joined
+    for path, image in iter(write_queue.get, None):
+        if not errors:
+            try:
+                tif.imwrite(path, image)
+            except Exception as error:
+                errors.append(error)
 
 def predict(checkpoint, test_dir, out_dir, bb, num_parts):
     # Initialize the U-Net architecture
     net = RSUNet()
 
+    # Slices are saved on a writer thread so the next part is predicted while
+    # the previous one is written. The queue holds views into each part's
+    # output volume rather than copies, and is bounded so a slow disk blocks
+    # the next part instead of keeping several parts' volumes alive
+    write_queue = queue.Queue(maxsize=16)
+    write_errors = []
+    writer = threading.Thread(target=write_tiffs, args=(write_queue, write_errors))
+    writer.start()
+    try:
+        predict_parts(checkpoint, test_dir, out_dir, bb, num_parts, net, write_queue)
+    finally:
+        write_queue.put(None)
+        writer.join()
+    if write_errors:
+        raise write_errors[0]
+
+def predict_parts(checkpoint, test_dir, out_dir, bb, num_parts, net, write_queue):
+    # The checkpoint is loaded and the net set up once for all parts
+    predictor = Predictor(net, checkpoint, gpu_device=0)
+    os.makedirs(out_dir, exist_ok=True)
     offset = 0
     for n in range(num_parts):
         bbn = BoundingBox(Vector(bb[0], bb[1], bb[2]), Vector(bb[3], bb[4], bb[5+n]))
@@ -27,18 +59,16 @@ def predict(checkpoint, test_dir, out_dir, bb, num_parts):
         
         with TiffVolume(os.path.join(test_dir, filename), bbn) as inputs:              
             # Predict
-            predictor = Predictor(net, checkpoint, gpu_device=0)
-            output_volume = Array(-np.inf*np.ones(inputs.getBoundingBox().getNumpyDim(), dtype=np.float32))
+            # The predictor blends 8-bit probability maps into output_volume
+            output_volume = Array(np.zeros(inputs.getBoundingBox().getNumpyDim(), dtype=np.uint8))
             print('bb0', inputs.getBoundingBox())
             predictor.run(inputs, output_volume)
                             
-            # Convert to probability map and save
-            probability_map = 1/(1+np.exp(-output_volume.getArray()))
+            # Save probability map
+            probability_map = output_volume.getArray()
             print('probability_map', type(probability_map), probability_map.shape, probability_map.dtype)
-            if not os.path.isdir(out_dir):
-                os.mkdir(out_dir)
             for i in range(probability_map.shape[0]):
-                tif.imsave(os.path.join(out_dir,'%03d.tif'%(i+offset)), np.uint8(255*probability_map[i,:,:]))  
+                write_queue.put((os.path.join(out_dir,'%03d.tif'%(i+offset)), probability_map[i,:,:]))
         offset = offset + bb[5+n]          
 
 if __name__=="__main__":
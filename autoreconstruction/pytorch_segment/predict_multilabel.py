@@ -1,17 +1,24 @@
 from neurotorch.nets.RSUNetMulti import RSUNetMulti
 from neurotorch.core.predictor_multilabel import Predictor
 from neurotorch.datasets.filetypes import TiffVolume
-from neurotorch.datasets.dataset import Array
+from neurotorch.datasets.dataset import Array, CudaArray
 from neurotorch.datasets.datatypes import (BoundingBox, Vector)
 import numpy as np
+import torch
 import tifffile as tif
 import os
 import glob
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 def predict(checkpoint, test_dir, out_dir, bb, num_parts):
     # Initialize the U-Net architecture
     net = RSUNetMulti()
+    # The checkpoint is loaded and the net set up once for all parts
+    predictor = Predictor(net, checkpoint, gpu_device=0)
+    ch_dirs = [os.path.join(out_dir,'ch%d'%(ch+1)) for ch in range(3)]
+    for ch_dir in ch_dirs:
+        os.makedirs(ch_dir, exist_ok=True)
 
     offset = 0
     for n in range(num_parts):
@@ -26,21 +33,26 @@ def predict(checkpoint, test_dir, out_dir, bb, num_parts):
 
         with TiffVolume(os.path.join(test_dir, filename), bbn) as inputs:              
             # Predict
-            predictor = Predictor(net, checkpoint, gpu_device=0)
             # Output_volume is a list (len3) of Arrays for each of 3 foreground channels (soma, axon, dendrite)
-            output_volume = [Array(np.zeros(inputs.getBoundingBox().getNumpyDim(), dtype=np.uint8)) for _ in range(3)]
+            shape = inputs.getBoundingBox().getNumpyDim()
+            if predictor.device.type == "cuda":
+                # Blend on the GPU and copy each channel back once
+                output_volume = [CudaArray(torch.zeros(shape, dtype=torch.uint8, device=predictor.device)) for _ in range(3)]
+            else:
+                output_volume = [Array(np.zeros(shape, dtype=np.uint8)) for _ in range(3)]
             print('bb0', inputs.getBoundingBox())
             predictor.run(inputs, output_volume)
+            output_volume = [volume.toArray() if isinstance(volume, CudaArray) else volume for volume in output_volume]
                             
-        if not os.path.isdir(out_dir):
-            os.mkdir(out_dir)
-        for ch in range(3):
-            ch_dir = os.path.join(out_dir,'ch%d'%(ch+1))
-            if not os.path.isdir(ch_dir):
-                os.mkdir(ch_dir)
+        slices = []
+        for ch, ch_dir in enumerate(ch_dirs):
             probability_map = output_volume[ch].getArray()
             for i in range(probability_map.shape[0]): # Save as multiple tif files
-                tif.imsave(os.path.join(ch_dir,'%03d.tif'%(i+offset)), probability_map[i,:,:])
+                slices.append((os.path.join(ch_dir,'%03d.tif'%(i+offset)), probability_map[i,:,:]))
+        # Write the slice files concurrently so their open/write/close overhead
+        # overlaps, file I/O releases the GIL
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            list(pool.map(lambda s: tif.imwrite(*s), slices))
         offset = offset + bb[5+n]          
 
 if __name__=="__main__":
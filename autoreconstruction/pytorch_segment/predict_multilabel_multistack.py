@@ -9,6 +9,7 @@ import tifffile as tif
 import os
 import glob
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import natsort
 import pandas as pd
 from datetime import date
@@ -37,6 +38,8 @@ def predict(checkpoint, specimen_dir, chunk_dir, bb, ids, error_list, gpu, files
     # Step 2. Run segmentation 
     try:
         net = RSUNetMulti()
+        # The checkpoint is loaded and the net set up once for all chunks
+        predictor = Predictor(net, checkpoint, gpu_device=gpu)
         count = [0,0,0]
         number_of_small_segments = len([ff for ff in os.listdir(chunk_dir) if '.tif' in ff])
         print('I think there are {} chunk tiff files in {}'.format(number_of_small_segments,chunk_dir))
@@ -47,12 +50,12 @@ def predict(checkpoint, specimen_dir, chunk_dir, bb, ids, error_list, gpu, files
             with TiffVolume(nth_tiff_stack, bbn) as inputs:                         
                 
                 # Predict
-                predictor = Predictor(net, checkpoint, gpu_device=gpu)
                 # Output_volume is a list (len3) of Arrays for each of 3 foreground channels (soma, axon, dendrite)
                 output_volume = [Array(np.zeros(inputs.getBoundingBox().getNumpyDim(), dtype=np.uint8)) for _ in range(3)] 
                 print('bb0', inputs.getBoundingBox())
                 predictor.run(inputs, output_volume)      
                 
+                slices = []
                 for ch in range(3):
                     ch_dir = os.path.join(seg_dir,'ch%d'%(ch+1))
                     if not os.path.isdir(ch_dir):
@@ -61,7 +64,11 @@ def predict(checkpoint, specimen_dir, chunk_dir, bb, ids, error_list, gpu, files
                     for i in range(probability_map.shape[0]): # Save as multiple tif files
                         #print('Prob Map Shape= ', probability_map.shape[0])
                         count[ch] +=1
-                        tif.imsave(os.path.join(ch_dir,'%03d.tif'%(count[ch])), probability_map[i,:,:])                             
+                        slices.append((os.path.join(ch_dir,'%03d.tif'%(count[ch])), probability_map[i,:,:]))
+                # Write the slice files concurrently so their open/write/close
+                # overhead overlaps, file I/O releases the GIL
+                with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+                    list(pool.map(lambda s: tif.imwrite(*s), slices))
     except:
         print('error with segmentation')
         error_list.append(str(ids)+ ' -segmentation')  
@@ -37,6 +37,8 @@ def predict(checkpoint, specimen_dir, chunk_dir, bb, ids, error_list, gpu, files
     # Step 2. Run segmentation 
     try:
         net = RSUNet()
+        # The checkpoint is loaded and the net set up once for all chunks
+        predictor = Predictor(net, checkpoint, gpu_device=gpu)
         count=0
         number_of_small_segments = len([ff for ff in os.listdir(chunk_dir) if '.tif' in ff])
         print('I think there are {} chunk tiff files in {}'.format(number_of_small_segments,chunk_dir))
@@ -47,17 +49,17 @@ def predict(checkpoint, specimen_dir, chunk_dir, bb, ids, error_list, gpu, files
             with TiffVolume(nth_tiff_stack, bbn) as inputs:                         
                 
                 # Predict
-                predictor = Predictor(net, checkpoint, gpu_device=gpu)
-                output_volume = Array(-np.inf*np.ones(inputs.getBoundingBox().getNumpyDim(), dtype=np.float32))
+                # The predictor blends 8-bit probability maps into output_volume
+                output_volume = Array(np.zeros(inputs.getBoundingBox().getNumpyDim(), dtype=np.uint8))
                 print('bb0', inputs.getBoundingBox())
                 predictor.run(inputs, output_volume)      
-                # Convert to probability map and save
-                probability_map = 1/(1+np.exp(-output_volume.getArray()))
+                # Save probability map
+                probability_map = output_volume.getArray()
                 print('probability_map', type(probability_map), probability_map.shape, probability_map.dtype)
                 for i in range(probability_map.shape[0]): # Save 8-bit version as multiple tif files
                     #print('Prob Map Shape= ', probability_map.shape[0])
                     count +=1
-                    tif.imsave(os.path.join(seg_dir,'%03d.tif'%(count)), np.uint8(255*probability_map[i,:,:]))                
+                    tif.imwrite(os.path.join(seg_dir,'%03d.tif'%(count)), probability_map[i,:,:])                
     except:
         print('error with segmentation')
         error_list.append(str(ids)+ ' -segmentation')  
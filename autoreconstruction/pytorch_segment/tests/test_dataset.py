@@ -0,0 +1,119 @@
+import unittest
+
+import numpy as np
+
+from autoreconstruction.pytorch_segment.neurotorch.datasets.dataset import Array, PooledVolume
+from autoreconstruction.pytorch_segment.neurotorch.datasets.datatypes import (BoundingBox,
+                                                                             Vector)
+
+
+class TestArray(unittest.TestCase):
+    def setUp(self):
+        self.array = np.arange(32*96*96, dtype=np.int64).reshape(32, 96, 96)
+        self.volume = Array(self.array,
+                            iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                       Vector(64, 64, 16)),
+                            stride=Vector(48, 48, 16))
+
+    def test_sample_order(self):
+        # Samples step along X first, then Y, then Z
+        corners = [self.volume._indexToBoundingBox(i).getEdges()[0]
+                   for i in range(len(self.volume))]
+
+        self.assertEqual(len(corners), 8)
+        self.assertEqual(corners[:4], [Vector(0, 0, 0), Vector(48, 0, 0),
+                                       Vector(0, 48, 0), Vector(48, 48, 0)])
+        self.assertEqual(corners[4], Vector(0, 0, 16))
+
+    def test_iteration_offset(self):
+        # The iteration size is normalized to the origin when it is set, an
+        # offset set on it directly still moves every sample
+        self.volume.iteration_size = BoundingBox(Vector(4, 2, 1),
+                                                 Vector(36, 34, 9))
+        indexes = list(range(len(self.volume)))
+        batch = np.empty((len(indexes), 1, 8, 32, 32), dtype=np.int64)
+        bounding_boxes = self.volume.getBatch(indexes, batch)
+
+        for i in indexes:
+            bounding_box = self.volume._indexToBoundingBox(i)
+            self.assertEqual(bounding_boxes[i], bounding_box)
+            np.testing.assert_array_equal(self.volume[i].getArray(), batch[i, 0])
+            np.testing.assert_array_equal(batch[i, 0],
+                                          self.volume.get(bounding_box).getArray())
+        self.assertEqual(bounding_boxes[1].getEdges()[0], Vector(52, 2, 1))
+
+    def test_get_inside(self):
+        bounding_box = BoundingBox(Vector(8, 4, 2), Vector(72, 68, 18))
+        sample = self.volume.get(bounding_box).getArray()
+
+        np.testing.assert_array_equal(sample, self.array[2:18, 4:68, 8:72])
+
+    def test_get_negative_offset(self):
+        # The bounding box starts before the volume on every axis, so the
+        # sample is zero-padded in front
+        bounding_box = BoundingBox(Vector(-8, -4, -2), Vector(56, 60, 14))
+        sample = self.volume.get(bounding_box).getArray()
+
+        self.assertEqual(sample.shape, (16, 64, 64))
+        np.testing.assert_array_equal(sample[2:, 4:, 8:],
+                                      self.array[:14, :60, :56])
+        self.assertTrue((sample[:2] == 0).all())
+        self.assertTrue((sample[:, :4] == 0).all())
+        self.assertTrue((sample[:, :, :8] == 0).all())
+
+    def test_get_disjoint(self):
+        bounding_box = BoundingBox(Vector(200, 0, 0), Vector(264, 64, 16))
+
+        with self.assertRaises(ValueError):
+            self.volume.get(bounding_box)
+
+    def test_pad_value(self):
+        self.volume.setPadValue(255)
+        bounding_box = BoundingBox(Vector(64, 64, 16), Vector(128, 128, 32))
+        sample = self.volume.get(bounding_box).getArray()
+
+        np.testing.assert_array_equal(sample[:, :32, :32],
+                                      self.array[16:32, 64:96, 64:96])
+        self.assertTrue((sample[:, 32:] == 255).all())
+        self.assertTrue((sample[:, :, 32:] == 255).all())
+
+    def test_batch_pad_value(self):
+        self.volume.setPadValue(255)
+        indexes = list(range(len(self.volume)))
+        batch = np.empty((len(indexes), 1, 16, 64, 64), dtype=np.int64)
+        self.volume.getBatch(indexes, batch)
+
+        for i in indexes:
+            np.testing.assert_array_equal(batch[i, 0],
+                                          self.volume[i].getArray())
+
+
+class TestPooledVolume(unittest.TestCase):
+    def setUp(self):
+        self.array = np.arange(32*64*256, dtype=np.uint16).reshape(32, 64, 256)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(64, 64, 16))
+        stride = Vector(64, 64, 16)
+        volumes = [Array(self.array[:, :, x:x+128],
+                         bounding_box=BoundingBox(Vector(x, 0, 0),
+                                                  Vector(x+128, 64, 32)),
+                         iteration_size=iteration_size, stride=stride)
+                   for x in (0, 128)]
+        self.volume = PooledVolume(volumes, iteration_size=iteration_size,
+                                   stride=stride)
+
+    def test_get_across_volumes(self):
+        bounding_box = BoundingBox(Vector(100, 10, 4), Vector(164, 60, 20))
+        sample = self.volume.get(bounding_box).getArray()
+
+        np.testing.assert_array_equal(sample, self.array[4:20, 10:60, 100:164])
+
+    def test_exit_shuts_down_pool(self):
+        self.volume.get(BoundingBox(Vector(100, 0, 0), Vector(164, 64, 16)))
+        self.assertIsNotNone(self.volume.pool)
+
+        self.volume.__exit__(None, None, None)
+        self.assertIsNone(self.volume.pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+
+from autoreconstruction.pytorch_segment.neurotorch.datasets.datatypes import (BoundingBox,
+                                                                             BoundingBoxArray,
+                                                                             Vector)
+
+
+class TestVector(unittest.TestCase):
+    def test_hash_matches_components(self):
+        vector = Vector(1, 2, 3)
+
+        self.assertEqual(hash(vector), hash((1, 2, 3)))
+        self.assertEqual(hash(vector), hash(Vector(1.0, 2.0, 3.0)))
+        self.assertEqual(vector, Vector(1.0, 2.0, 3.0))
+
+    def test_not_equal_to_tuple(self):
+        vector = Vector(1, 2, 3)
+
+        self.assertIs(vector.__eq__((1, 2, 3)), NotImplemented)
+        self.assertNotEqual(vector, (1, 2, 3))
+        self.assertNotEqual(vector, [1, 2, 3])
+
+        # Equal hashes but unequal keys, so both are kept
+        self.assertEqual(len({vector: 0, (1, 2, 3): 1}), 2)
+
+    def test_dict_key(self):
+        keys = {Vector(1, 2, 3): "a"}
+
+        self.assertEqual(keys[Vector(1, 2, 3)], "a")
+        self.assertNotIn(Vector(3, 2, 1), keys)
+
+    def test_immutable(self):
+        vector = Vector(1, 2, 3)
+        summed = vector + Vector(1, 1, 1)
+
+        for array in (vector._arr, summed._arr):
+            with self.assertRaises(ValueError):
+                array[0] = 5
+        self.assertFalse(hasattr(vector, "setComponents"))
+
+
+class TestBoundingBox(unittest.TestCase):
+    def setUp(self):
+        self.bounding_box = BoundingBox(Vector(0, 0, 0), Vector(4, 4, 4))
+
+    def test_is_subset(self):
+        inside = BoundingBox(Vector(1, 1, 1), Vector(3, 3, 3))
+        # Inside along some axes only
+        crossing = BoundingBox(Vector(1, 1, 1), Vector(5, 3, 3))
+
+        self.assertTrue(inside.isSubset(self.bounding_box))
+        self.assertTrue(self.bounding_box.isSubset(self.bounding_box))
+        self.assertFalse(crossing.isSubset(self.bounding_box))
+        self.assertTrue(self.bounding_box.isSuperset(inside))
+        self.assertFalse(self.bounding_box.isSuperset(crossing))
+
+    def test_intersect(self):
+        other = BoundingBox(Vector(2, -1, 1), Vector(6, 3, 3))
+
+        self.assertEqual(self.bounding_box.intersect(other),
+                         BoundingBox(Vector(2, 0, 1), Vector(4, 3, 3)))
+
+    def test_intersect_touching(self):
+        other = BoundingBox(Vector(4, 0, 0), Vector(6, 4, 4))
+        intersection = self.bounding_box.intersect(other)
+
+        self.assertEqual(intersection.getSize(), Vector(0, 4, 4))
+
+    def test_intersect_disjoint(self):
+        other = BoundingBox(Vector(5, 0, 0), Vector(6, 4, 4))
+
+        with self.assertRaises(ValueError):
+            self.bounding_box.intersect(other)
+
+    def test_hash(self):
+        same = BoundingBox(Vector(0, 0, 0), Vector(4, 4, 4))
+
+        self.assertEqual(self.bounding_box, same)
+        self.assertEqual(hash(self.bounding_box), hash(same))
+        self.assertEqual(len({self.bounding_box, same}), 1)
+
+    def test_not_equal_to_other_types(self):
+        self.assertIs(self.bounding_box.__eq__((0, 0, 0, 4, 4, 4)),
+                      NotImplemented)
+        self.assertNotEqual(self.bounding_box, None)
+
+    def test_immutable(self):
+        self.assertFalse(hasattr(self.bounding_box, "setEdges"))
+
+
+class TestBoundingBoxArray(unittest.TestCase):
+    def setUp(self):
+        self.bounding_boxes = [BoundingBox(Vector(0, 0, 0), Vector(2, 2, 2)),
+                               BoundingBox(Vector(2, 0, 0), Vector(4, 2, 2))]
+
+    def test_from_bounding_boxes(self):
+        bounding_boxes = BoundingBoxArray.fromBoundingBoxes(self.bounding_boxes)
+
+        self.assertEqual(bounding_boxes.getEdges().shape, (2, 2, 3))
+        self.assertEqual(list(bounding_boxes), self.bounding_boxes)
+
+    def test_touching_boxes_do_not_overlap(self):
+        bounding_boxes = BoundingBoxArray.fromBoundingBoxes(self.bounding_boxes)
+
+        self.assertFalse(bounding_boxes.isOverlapping())
+
+    def test_overlapping_boxes(self):
+        bounding_boxes = self.bounding_boxes + [BoundingBox(Vector(1, 1, 1),
+                                                            Vector(3, 3, 3))]
+        bounding_boxes = BoundingBoxArray.fromBoundingBoxes(bounding_boxes)
+
+        self.assertTrue(bounding_boxes.isOverlapping())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from autoreconstruction.pytorch_segment.neurotorch.nets.RSUNetMulti import RSUNetMulti
+from autoreconstruction.pytorch_segment.neurotorch.core.predictor_multilabel import Predictor
+from autoreconstruction.pytorch_segment.neurotorch.core.predictor_base import load_state_dict
+
+# predict_multilabel.py and the other scripts import the neurotorch package
+# from this directory
+PYTORCH_SEGMENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestPredictor(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        net = RSUNetMulti().eval()
+
+        # Non-trivial batch norm statistics, so fusing them changes the convs
+        for module in net.modules():
+            if isinstance(module, torch.nn.BatchNorm3d):
+                module.running_mean.uniform_(-1, 1)
+                module.running_var.uniform_(0.5, 2)
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp_dir.name, "net.ckpt")
+        torch.save(net.state_dict(), self.checkpoint)
+        self.state_dict = net.state_dict()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_checkpoint_twice(self):
+        predictor = Predictor(RSUNetMulti(), self.checkpoint,
+                              compile_net=False)
+        predictor.loadCheckpoint(self.checkpoint)
+
+        self.assertEqual(predictor.getNet().state_dict().keys(),
+                         self.state_dict.keys())
+
+    def test_fused_net_matches_checkpoint(self):
+        predictor = Predictor(RSUNetMulti(), self.checkpoint,
+                              compile_net=False)
+        self.assertIsNot(predictor.inference_net, predictor.getNet())
+
+        inputs = torch.rand(1, 1, 16, 64, 64)
+        with torch.no_grad():
+            expected = predictor.getNet()(inputs)
+            outputs = predictor.inference_net(inputs)
+
+        for output, expected_output in zip(outputs, expected):
+            self.assertTrue(torch.allclose(output, expected_output,
+                                           atol=1e-4))
+
+    def test_cached_state_dict_on_host(self):
+        state_dict = load_state_dict(self.checkpoint)
+
+        self.assertIs(load_state_dict(self.checkpoint), state_dict)
+        self.assertTrue(all(tensor.device.type == "cpu"
+                            for tensor in state_dict.values()))
+
+    def test_rewritten_checkpoint_is_reloaded(self):
+        load_state_dict(self.checkpoint)
+        state_dict = {key: torch.ones_like(tensor)
+                      for key, tensor in self.state_dict.items()}
+        torch.save(state_dict, self.checkpoint)
+
+        # Bump the modification time in case the rewrite was too quick to
+        # change it
+        stat = os.stat(self.checkpoint)
+        os.utime(self.checkpoint, ns=(stat.st_atime_ns,
+                                      stat.st_mtime_ns + 1))
+
+        self.assertTrue(torch.equal(
+            load_state_dict(self.checkpoint)["convmod0.conv1.conv.weight"],
+            state_dict["convmod0.conv1.conv.weight"]))
+
+
+class TestScriptPredictor(unittest.TestCase):
+    """
+    Runs the multilabel predictor the way predict_multilabel.py does, with
+every class imported through the neurotorch package
+    """
+    def setUp(self):
+        if PYTORCH_SEGMENT_DIR not in sys.path:
+            sys.path.insert(0, PYTORCH_SEGMENT_DIR)
+
+        from neurotorch.nets.RSUNetMulti import RSUNetMulti
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp_dir.name, "net.ckpt")
+        torch.manual_seed(0)
+        torch.save(RSUNetMulti().state_dict(), self.checkpoint)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_device_blend(self):
+        from neurotorch.nets.RSUNetMulti import RSUNetMulti
+        from neurotorch.core.predictor_multilabel import Predictor
+        from neurotorch.datasets.dataset import Array, CudaArray
+
+        predictor = Predictor(RSUNetMulti(), self.checkpoint, gpu_device=0,
+                              compile_net=False)
+        inputs = Array(np.random.default_rng(0).integers(0, 255, (32, 128, 192),
+                                                          dtype=np.uint8))
+        shape = inputs.getBoundingBox().getNumpyDim()
+        host_volume = [Array(np.zeros(shape, dtype=np.uint8)) for _ in range(3)]
+        predictor.run(inputs, host_volume, batch_size=4)
+
+        device_volume = [CudaArray(torch.zeros(shape, dtype=torch.uint8,
+                                               device=predictor.device))
+                         for _ in range(3)]
+        self.assertTrue(predictor.isOnDevice(device_volume))
+
+        # The device blend path never copies outputs back to the host
+        def to_host(*args):
+            raise AssertionError("outputs were copied to the host")
+        predictor.toHost = predictor.toHostAsync = to_host
+        predictor.run(inputs, device_volume, batch_size=4)
+
+        for device_channel, host_channel in zip(device_volume, host_volume):
+            np.testing.assert_array_equal(device_channel.toArray().getArray(),
+                                          host_channel.getArray())
+
+
+if __name__ == '__main__':
+    unittest.main()